@@ -1,14 +1,132 @@
-from flask import Flask, request, jsonify
+import os
+import gzip
+import time
+import logging
+import threading
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import Future
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
 import requests
+from requests.adapters import HTTPAdapter
 
 app = Flask(__name__)
 CORS(app, resources={r"/*": {"origins": "*", "allow_headers": ["Content-Type", "Authorization"]}})
 
-API_URL = "http://18.191.173.194:8080/query"
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+log = logging.getLogger("proxy")
+
+API_URL = os.environ.get("RAG_API_URL", "http://18.191.173.194:8080/query")
+UPSTREAM_POOL_SIZE = int(os.environ.get("UPSTREAM_POOL_SIZE", "32"))
+UPSTREAM_CONNECT_TIMEOUT = float(os.environ.get("UPSTREAM_CONNECT_TIMEOUT", "3"))
+UPSTREAM_READ_TIMEOUT = float(os.environ.get("UPSTREAM_READ_TIMEOUT", "30"))
+# Results only change when the index is rebuilt, so a short TTL is safe.
+CACHE_TTL_SECONDS = float(os.environ.get("CACHE_TTL_SECONDS", "30"))
+CACHE_MAX_ENTRIES = int(os.environ.get("CACHE_MAX_ENTRIES", "1024"))
+GZIP_MIN_BYTES = int(os.environ.get("GZIP_MIN_BYTES", "512"))
+
+def upstream_session(pool_size):
+    # One keep-alive pool shared by every request thread.
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update({"Content-Type": "application/json"})
+    return session
+
+upstream = upstream_session(UPSTREAM_POOL_SIZE)
+
+class UpstreamReply:
+    """An upstream response kept as bytes, with its gzip form made once."""
+
+    def __init__(self, status, body):
+        self.status = status
+        self.body = body
+        self.gzipped = gzip.compress(body, compresslevel=5) if len(body) >= GZIP_MIN_BYTES else None
+
+class ResponseCache:
+    """Successful replies by (query, k) for `ttl` seconds, least recently used evicted first."""
+
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires, reply = entry
+            if expires < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return reply
+
+    def put(self, key, reply):
+        if self.ttl <= 0:
+            return
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, reply)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+class SingleFlight:
+    """Runs one call per key at a time; concurrent callers with the same key
+    wait for that call and share its result."""
+
+    def __init__(self):
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def run(self, key, fn):
+        with self.lock:
+            future = self.calls.get(key)
+            leader = future is None
+            if leader:
+                future = self.calls[key] = Future()
+        if not leader:
+            return future.result(), True
+        try:
+            future.set_result(fn())
+        except Exception as e:
+            future.set_exception(e)
+        finally:
+            with self.lock:
+                del self.calls[key]
+        return future.result(), False
+
+response_cache = ResponseCache(CACHE_TTL_SECONDS, CACHE_MAX_ENTRIES)
+inflight = SingleFlight()
+
+def cache_key(query, k):
+    # The RAG service applies the same folding, so these variants share a result.
+    return " ".join(unicodedata.normalize("NFKC", query).lower().split()), k
+
+def fetch_upstream(query, k, key):
+    response = upstream.post(API_URL, json={"query": query, "k": k},
+                             timeout=(UPSTREAM_CONNECT_TIMEOUT, UPSTREAM_READ_TIMEOUT))
+    reply = UpstreamReply(response.status_code, response.content)
+    if reply.status == 200:
+        response_cache.put(key, reply)
+    return reply
+
+def send_reply(reply):
+    if reply.gzipped is not None and "gzip" in request.headers.get("Accept-Encoding", ""):
+        response = Response(reply.gzipped, status=reply.status, mimetype="application/json")
+        response.headers["Content-Encoding"] = "gzip"
+    else:
+        response = Response(reply.body, status=reply.status, mimetype="application/json")
+    response.headers["Vary"] = "Accept-Encoding"
+    return response
 
 @app.route('/query', methods=['POST'])
 def query_research_papers():
+    started = time.perf_counter()
     try:
         data = request.get_json()
         query = data.get("query", "").strip()
@@ -17,20 +135,32 @@ def query_research_papers():
         if not query:
             return jsonify({"error": "Query cannot be empty"}), 400
 
-        print(f"Sending request to {API_URL} with query: {query}, k: {k}")
-
-        response = requests.post(API_URL, json={"query": query, "k": k}, headers={"Content-Type": "application/json"})
-
-        print(f"Response Status Code: {response.status_code}")
-        print(f"Response Content: {response.text}")
+        key = cache_key(query, k)
+        reply = response_cache.get(key)
+        source = "cache"
+        if reply is None:
+            reply, coalesced = inflight.run(key, lambda: fetch_upstream(query, k, key))
+            source = "coalesced" if coalesced else "upstream"
 
-        if response.status_code != 200:
-            return jsonify({"error": f"Failed to fetch data. Status: {response.status_code}", "details": response.text}), response.status_code
+        if reply.status != 200:
+            log.warning("query k=%d upstream status %d (%d bytes) in %.1f ms", k, reply.status, len(reply.body),
+                        1000 * (time.perf_counter() - started))
+            return jsonify({"error": f"Failed to fetch data. Status: {reply.status}",
+                            "details": reply.body.decode('utf-8', 'replace')}), reply.status
 
-        return jsonify(response.json())
+        response = send_reply(reply)
+        log.info("query k=%d %s %d bytes (%s sent) in %.1f ms", k, source, len(reply.body),
+                 response.headers.get("Content-Length"), 1000 * (time.perf_counter() - started))
+        return response
 
+    except requests.Timeout as e:
+        log.error("query upstream timeout after %.1f ms: %s", 1000 * (time.perf_counter() - started), e)
+        return jsonify({"error": "Upstream timed out"}), 504
+    except requests.ConnectionError as e:
+        log.error("query upstream unreachable: %s", e)
+        return jsonify({"error": "Upstream unavailable"}), 502
     except Exception as e:
-        print(f"Error occurred: {str(e)}")
+        log.exception("query failed")
         return jsonify({"error": str(e)}), 500
 
 if __name__ == '__main__':
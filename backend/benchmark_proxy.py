@@ -0,0 +1,161 @@
+import json
+import time
+import argparse
+import threading
+import http.client
+import numpy as np
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from werkzeug.serving import make_server
+
+# Drives the proxy against a local stub of the RAG service. The stub answers
+# /query with k synthetic papers after a fixed delay and counts the calls it
+# gets, so the report shows how many requests the cache and coalescing kept
+# off the upstream, along with proxy throughput, latency and bytes sent.
+
+WORDS = "graph neural protein climate sparse retrieval quantum causal genome federated battery vaccine".split()
+
+class StubUpstream:
+    def __init__(self, latency_ms):
+        self.latency = latency_ms / 1000
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body go out in separate writes; without this, keep-alive
+            # connections stall on delayed ACKs and the pooled modes look slow.
+            disable_nagle_algorithm = True
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                with stub.lock:
+                    stub.calls += 1
+                time.sleep(stub.latency)
+                results = [{
+                    "id": f"https://openalex.org/W{abs(hash((body['query'], i))) % 10**10:010d}",
+                    "source": "openalex",
+                    "title": f"{body['query'].title()} result {i}",
+                    "abstract": " ".join(WORDS[(i + j) % len(WORDS)] for j in range(180)),
+                    "year": 2000 + i,
+                    "score": 1.0 / (i + 1),
+                } for i in range(body.get("k", 10))]
+                payload = json.dumps({"query": body["query"], "results": results}).encode('utf-8')
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+def start_in_thread(server):
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def drive(port, queries, args):
+    latencies = []
+    sent_bytes = 0
+    statuses = {}
+    lock = threading.Lock()
+    next_request = iter(range(args.requests))
+
+    def worker(worker_id):
+        nonlocal sent_bytes
+        rng = np.random.default_rng(args.seed + worker_id)
+        connection = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+        local_latencies, local_bytes, local_statuses = [], 0, {}
+        while True:
+            with lock:
+                if next(next_request, None) is None:
+                    break
+            payload = json.dumps({"query": queries[rng.integers(len(queries))], "k": args.k})
+            started = time.perf_counter()
+            connection.request("POST", "/query", body=payload,
+                               headers={"Content-Type": "application/json", "Accept-Encoding": "gzip"})
+            response = connection.getresponse()
+            local_bytes += len(response.read())
+            local_latencies.append(time.perf_counter() - started)
+            local_statuses[response.status] = local_statuses.get(response.status, 0) + 1
+        connection.close()
+        with lock:
+            latencies.extend(local_latencies)
+            sent_bytes += local_bytes
+            for status, count in local_statuses.items():
+                statuses[status] = statuses.get(status, 0) + count
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(args.concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    latencies_ms = 1000 * np.asarray(latencies)
+    return {
+        "requests": len(latencies),
+        "throughput_rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(float(np.percentile(latencies_ms, 50)), 2),
+        "p99_ms": round(float(np.percentile(latencies_ms, 99)), 2),
+        "bytes_per_response": round(sent_bytes / max(1, len(latencies)), 1),
+        "status_counts": {str(status): count for status, count in sorted(statuses.items())},
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the /query proxy against a stub RAG service.")
+    parser.add_argument("--requests", type=int, default=3000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--unique-queries", type=int, default=200,
+                        help="size of the query pool; repeats are what the cache and coalescing absorb")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--upstream-latency-ms", type=float, default=50.0)
+    parser.add_argument("--modes", nargs="+", default=["direct", "pooled", "coalesced", "cached"],
+                        help="direct: new connection per call, no cache (the old proxy); pooled: keep-alive "
+                             "pool only; coalesced: plus single-flight; cached: plus the TTL cache")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the JSON report to this file")
+    args = parser.parse_args()
+
+    import logging
+    import requests
+    import app as proxy
+
+    logging.getLogger("proxy").setLevel(logging.WARNING)
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    stub = StubUpstream(args.upstream_latency_ms)
+    upstream_server = start_in_thread(ThreadingHTTPServer(("127.0.0.1", 0), stub.handler()))
+    proxy.API_URL = f"http://127.0.0.1:{upstream_server.server_address[1]}/query"
+    proxy_server = start_in_thread(make_server("127.0.0.1", 0, proxy.app, threaded=True))
+    port = proxy_server.server_port
+
+    rng = np.random.default_rng(args.seed)
+    queries = [" ".join(rng.choice(WORDS, size=rng.integers(2, 5))) for _ in range(args.unique_queries)]
+    pooled_session = proxy.upstream
+    coalesce = proxy.SingleFlight.run
+    results = []
+    for mode in args.modes:
+        # Each mode removes one of the optimisations from the full proxy.
+        proxy.response_cache = proxy.ResponseCache(proxy.CACHE_TTL_SECONDS if mode == "cached" else 0,
+                                                   proxy.CACHE_MAX_ENTRIES)
+        proxy.upstream = requests if mode == "direct" else pooled_session
+        proxy.SingleFlight.run = coalesce if mode in ("coalesced", "cached") else \
+            (lambda self, key, fn: (fn(), False))
+        calls_before = stub.calls
+        result = dict(mode=mode, **drive(port, queries, args))
+        result["upstream_calls"] = stub.calls - calls_before
+        print(json.dumps(result))
+        results.append(result)
+    proxy.SingleFlight.run = coalesce
+
+    report = {"params": {key: value for key, value in vars(args).items() if key != "output"}, "results": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+import json
+import time
+import hashlib
+import argparse
+import tempfile
+import threading
+import numpy as np
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from prefetch import ApiClient, LocalSink, TokenBucket, harvest
+
+# Local stand-in for the OpenAlex and Semantic Scholar search APIs. Every
+# topic matches a fixed set of papers drawn from a shared pool, so topics
+# overlap the way real ones do; each API has its own rate limit and answers
+# 429 beyond it. "run" starts the server, harvests against it and reports
+# the server's throughput next to the harvester's.
+
+WORDS = "graph neural protein climate sparse retrieval quantum causal genome federated battery vaccine".split()
+
+class MockApis:
+    def __init__(self, pool_size, papers_per_topic, rate, latency_ms):
+        self.pool_size = pool_size
+        self.papers_per_topic = papers_per_topic
+        self.latency = latency_ms / 1000
+        self.buckets = {"openalex": TokenBucket(rate, burst=int(rate) or 1),
+                        "semantic": TokenBucket(rate, burst=int(rate) or 1)}
+        self.stats = {"openalex": Counter(), "semantic": Counter()}
+        self.served = {"openalex": set(), "semantic": set()}
+        self.lock = threading.Lock()
+        self.started = time.perf_counter()
+
+    def topic_papers(self, topic):
+        seed = int.from_bytes(hashlib.sha1(topic.encode('utf-8')).digest()[:8], "little")
+        return np.random.default_rng(seed).choice(self.pool_size, size=min(self.papers_per_topic, self.pool_size),
+                                                  replace=False).tolist()
+
+    def admit(self, api):
+        bucket = self.buckets[api]
+        with bucket.lock:
+            now = time.monotonic()
+            bucket.tokens = min(bucket.burst, bucket.tokens + (now - bucket.updated) * bucket.rate)
+            bucket.updated = now
+            if bucket.tokens < 1:
+                return False
+            bucket.tokens -= 1
+            return True
+
+    def record(self, api, status, papers=()):
+        with self.lock:
+            self.stats[api][str(status)] += 1
+            self.stats[api]["papers"] += len(papers)
+            self.served[api].update(papers)
+
+    def openalex_page(self, params):
+        topic = params["filter"].split(":", 1)[1]
+        per_page = int(params.get("per_page", 25))
+        cursor = params.get("cursor", "*")
+        start = 0 if cursor == "*" else int(cursor)
+        papers = self.topic_papers(topic)[start:start + per_page]
+        following = start + len(papers)
+        results = [{
+            "id": f"https://openalex.org/W{paper:010d}",
+            "display_name": f"Paper {paper} on {WORDS[paper % len(WORDS)]}",
+            "abstract_inverted_index": {"Abstract": [0], "of": [1], "paper": [2], str(paper): [3]},
+            "publication_year": 1990 + paper % 35,
+        } for paper in papers]
+        next_cursor = str(following) if following < self.papers_per_topic else None
+        return {"meta": {"count": self.papers_per_topic, "next_cursor": next_cursor}, "results": results}, \
+            [result["id"] for result in results]
+
+    def semantic_page(self, params):
+        offset = int(params.get("offset", 0))
+        limit = int(params.get("limit", 10))
+        papers = self.topic_papers(params["query"])[offset:offset + limit]
+        following = offset + len(papers)
+        data = [{
+            "paperId": f"{paper:040x}",
+            "title": f"Paper {paper} on {WORDS[paper % len(WORDS)]}",
+            "abstract": f"Abstract of paper {paper}.",
+            "year": 1990 + paper % 35,
+            "authors": [{"name": f"Author {paper % 97}"}, {"name": f"Author {paper % 89}"}],
+        } for paper in papers]
+        page = {"total": self.papers_per_topic, "offset": offset, "data": data}
+        if following < self.papers_per_topic:
+            page["next"] = following
+        return page, [paper["paperId"] for paper in data]
+
+    def report(self):
+        elapsed = time.perf_counter() - self.started
+        report = {"seconds": round(elapsed, 2)}
+        for api, stats in self.stats.items():
+            requests = sum(count for status, count in stats.items() if status.isdigit())
+            report[api] = dict(stats, unique_papers=len(self.served[api]),
+                               requests_per_second=round(requests / elapsed, 1),
+                               papers_per_second=round(stats["papers"] / elapsed, 1))
+        return report
+
+def make_handler(apis):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            params = {key: values[0] for key, values in parse_qs(url.query).items()}
+            api = "openalex" if url.path == "/works" else "semantic" if url.path.endswith("/paper/search") else None
+            if api is None:
+                return self.reply(404, {"error": "not found"})
+            if apis.latency:
+                time.sleep(apis.latency)
+            if not apis.admit(api):
+                apis.record(api, 429)
+                return self.reply(429, {"error": "rate limited"}, {"Retry-After": "1"})
+            body, papers = apis.openalex_page(params) if api == "openalex" else apis.semantic_page(params)
+            apis.record(api, 200, papers)
+            self.reply(200, body)
+
+        def reply(self, status, body, headers=None):
+            payload = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+def start_server(apis, port):
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(apis))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def run(args, apis):
+    server = start_server(apis, args.port)
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    clients = {
+        "openalex": ApiClient("openalex", f"{base}/works", args.client_rate, burst=int(args.client_rate) or 1,
+                              backoff=0.2, pool_size=args.workers),
+        "semantic": ApiClient("semantic", f"{base}/graph/v1/paper/search", args.client_rate,
+                              burst=int(args.client_rate) or 1, backoff=0.2, pool_size=args.workers),
+    }
+    topics = [f"topic {i}" for i in range(args.topics)]
+    output_dir = args.output_dir or tempfile.mkdtemp(prefix="prefetch-mock-")
+    harvester = harvest(topics, clients, LocalSink(output_dir), args.max_results, args.workers)
+    server.shutdown()
+    report = {"output_dir": output_dir, "harvester": harvester, "server": apis.report()}
+    # Every distinct paper the server handed out should be written exactly once.
+    for api in ("openalex", "semantic"):
+        report["server"][api]["deduplicated_correctly"] = \
+            harvester[api].get("papers", 0) == report["server"][api]["unique_papers"]
+    print(json.dumps(report, indent=2))
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock OpenAlex and Semantic Scholar APIs for the harvester.")
+    parser.add_argument("command", choices=["run", "serve"], nargs="?", default="run")
+    parser.add_argument("--port", type=int, default=0, help="0 picks a free port (run only)")
+    parser.add_argument("--pool", type=int, default=20000, help="distinct papers shared by all topics")
+    parser.add_argument("--papers-per-topic", type=int, default=1000)
+    parser.add_argument("--rate", type=float, default=50.0, help="requests/s each mock API serves before 429s")
+    parser.add_argument("--latency-ms", type=float, default=20.0)
+    parser.add_argument("--topics", type=int, default=20)
+    parser.add_argument("--max-results", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--client-rate", type=float, default=40.0, help="harvester token-bucket rate per API")
+    parser.add_argument("--output-dir", help="where the harvester writes; a temporary directory by default")
+    args = parser.parse_args()
+
+    apis = MockApis(args.pool, args.papers_per_topic, args.rate, args.latency_ms)
+    if args.command == "serve":
+        server = ThreadingHTTPServer(("127.0.0.1", args.port or 8765), make_handler(apis))
+        print(f"Serving on http://127.0.0.1:{server.server_address[1]}; set OPENALEX_URL to /works and "
+              f"SEMANTIC_SCHOLAR_URL to /graph/v1/paper/search. Ctrl-C prints throughput.")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            print(json.dumps(apis.report(), indent=2))
+    else:
+        run(args, apis)
+
+if __name__ == "__main__":
+    main()
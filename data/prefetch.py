@@ -3,36 +3,122 @@ import json
 import requests
 import boto3
 import time
+import threading
+import requests.adapters
 import pandas as pd
 from io import StringIO
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-def fetch_openalex_data(query, per_page=20):
-    url = "https://api.openalex.org/works"
-    params = {
-        'filter': f'title.search:{query}',
-        'per_page': per_page
-    }
-    response = requests.get(url, params=params)
-    response.raise_for_status()
-    return response.json()
-
-def fetch_semantic_scholar_data(query, limit=20, retries=3, backoff=2):
-    url = "https://api.semanticscholar.org/graph/v1/paper/search"
-    params = {
-        'query': query,
-        'limit': limit,
-        'fields': 'paperId,title,abstract,authors,year'
-    }
-    for attempt in range(retries):
-        response = requests.get(url, params=params)
-        if response.status_code == 429:
-            print(f"Rate limit hit. Retrying in {backoff} seconds...")
-            time.sleep(backoff)
-            backoff *= 2
-        else:
-            response.raise_for_status()
-            return response.json()
-    response.raise_for_status()
+OPENALEX_URL = os.environ.get("OPENALEX_URL", "https://api.openalex.org/works")
+SEMANTIC_SCHOLAR_URL = os.environ.get("SEMANTIC_SCHOLAR_URL", "https://api.semanticscholar.org/graph/v1/paper/search")
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Semantic Scholar's relevance search serves at most the first 1000 results.
+SEMANTIC_SCHOLAR_MAX_RESULTS = 1000
+
+class TokenBucket:
+    """Allows `rate` requests per second on average and bursts of `burst`."""
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+class ApiClient:
+    """Rate-limited GETs against one API, shared by every topic's worker.
+
+    429s and 5xx responses are retried up to `retries` times, honouring
+    Retry-After when the API sends one and backing off exponentially
+    otherwise; the bucket is consulted before every attempt.
+    """
+
+    def __init__(self, name, url, rate, burst=1, retries=4, backoff=2.0, headers=None, pool_size=16):
+        self.name = name
+        self.url = url
+        self.bucket = TokenBucket(rate, burst)
+        self.retries = retries
+        self.backoff = backoff
+        self.session = requests.Session()
+        self.session.headers.update(headers or {})
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.stats = Counter()
+        self.lock = threading.Lock()
+
+    def count(self, **counts):
+        with self.lock:
+            self.stats.update(counts)
+
+    def get(self, params):
+        for attempt in range(self.retries + 1):
+            self.bucket.acquire()
+            try:
+                response = self.session.get(self.url, params=params, timeout=30)
+            except requests.ConnectionError as e:
+                if attempt == self.retries:
+                    raise
+                delay = self.backoff * 2 ** attempt
+                print(f"{self.name}: {e}; retrying in {delay:.1f}s")
+            else:
+                self.count(requests=1)
+                if response.status_code not in RETRY_STATUSES or attempt == self.retries:
+                    response.raise_for_status()
+                    return response.json()
+                retry_after = response.headers.get("Retry-After")
+                delay = float(retry_after) if retry_after and retry_after.isdigit() else self.backoff * 2 ** attempt
+                print(f"{self.name}: HTTP {response.status_code}; retrying in {delay:.1f}s")
+            self.count(retries=1)
+            time.sleep(delay)
+
+def fetch_openalex_pages(client, query, per_page=200, max_results=1000):
+    """Yield result pages for `query`, following OpenAlex's cursor."""
+    cursor = "*"
+    fetched = 0
+    while cursor and fetched < max_results:
+        params = {
+            'filter': f'title.search:{query}',
+            'per_page': min(per_page, max_results),
+            'cursor': cursor
+        }
+        data = client.get(params)
+        results = data.get("results", [])
+        if not results:
+            return
+        fetched += len(results)
+        cursor = data.get("meta", {}).get("next_cursor")
+        yield data
+
+def fetch_semantic_scholar_pages(client, query, limit=100, max_results=1000):
+    """Yield result pages for `query`, following Semantic Scholar's offset."""
+    offset = 0
+    max_results = min(max_results, SEMANTIC_SCHOLAR_MAX_RESULTS)
+    while offset is not None and offset < max_results:
+        params = {
+            'query': query,
+            'offset': offset,
+            'limit': min(limit, max_results - offset),
+            'fields': 'paperId,title,abstract,authors,year'
+        }
+        data = client.get(params)
+        if not data.get("data"):
+            return
+        offset = data.get("next")
+        yield data
 
 def reconstruct_abstract(abstract_inverted_index):
     if not abstract_inverted_index:
@@ -97,30 +183,131 @@ def generate_key(prefix, query, suffix, use_timestamp=True):
         key = f"{prefix}/{safe_query}_{suffix}"
     return key
 
-def main():
-    query = "TOPIC_NAME"
-    bucket_name = "BUCKET_NAME"
-    aws_region = "us-east-1"
+class SeenPapers:
+    """Ids already harvested, per source, across every topic of the run."""
+
+    def __init__(self):
+        self.ids = {"openalex": set(), "semantic": set()}
+        self.lock = threading.Lock()
+
+    def claim(self, source, items, id_field):
+        # Keep the first copy of each paper; the same paper often matches several topics.
+        fresh = []
+        with self.lock:
+            seen = self.ids[source]
+            for item in items:
+                paper_id = item.get(id_field)
+                if paper_id and paper_id not in seen:
+                    seen.add(paper_id)
+                    fresh.append(item)
+        return fresh
+
+HARVEST_SOURCES = {
+    # source: (pager, results field, id field, normalizer, file suffix)
+    "openalex": (fetch_openalex_pages, "results", "id", normalize_openalex_data, "openalex"),
+    "semantic": (fetch_semantic_scholar_pages, "data", "paperId", normalize_semantic_data, "semantic"),
+}
+
+class LocalSink:
+    """Writes to a directory instead of S3, for runs against the mock APIs."""
 
-    openalex_raw = fetch_openalex_data(query)
-    semantic_raw = fetch_semantic_scholar_data(query)
+    def __init__(self, directory):
+        self.directory = directory
 
-    openalex_raw_key = generate_key("raw", query, "openalex_raw.json")
-    semantic_raw_key = generate_key("raw", query, "semantic_raw.json")
-    openalex_csv_key = generate_key("normalized", query, "openalex_data.csv")
-    semantic_csv_key = generate_key("normalized", query, "semantic_data.csv")
+    def store(self, key, data):
+        path = os.path.join(self.directory, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            f.write(data)
 
-    store_to_s3(bucket_name, openalex_raw_key, json.dumps(openalex_raw, indent=2), aws_region)
-    store_to_s3(bucket_name, semantic_raw_key, json.dumps(semantic_raw, indent=2), aws_region)
+class S3Sink:
+    def __init__(self, bucket_name, aws_region="us-east-1"):
+        self.bucket_name = bucket_name
+        self.aws_region = aws_region
 
-    openalex_normalized = normalize_openalex_data(openalex_raw)
-    semantic_normalized = normalize_semantic_data(semantic_raw)
+    def store(self, key, data):
+        store_to_s3(self.bucket_name, key, data, self.aws_region)
 
-    df_openalex = pd.DataFrame(openalex_normalized)
-    df_semantic = pd.DataFrame(semantic_normalized)
+def harvest_topic(client, source, topic, seen, sink, max_results):
+    """Fetch every page of one topic from one API, writing raw pages as they
+    arrive and the normalized, deduplicated CSV once the topic is done."""
+    pager, results_field, id_field, normalize, suffix = HARVEST_SOURCES[source]
+    rows = []
+    pages = 0
+    try:
+        for data in pager(client, topic, max_results=max_results):
+            sink.store(generate_key("raw", topic, f"{suffix}_raw_{pages:04d}.json"), json.dumps(data, indent=2))
+            items = data.get(results_field, [])
+            fresh = seen.claim(source, items, id_field)
+            rows.extend(normalize({results_field: fresh}))
+            client.count(pages=1, papers=len(fresh), duplicates=len(items) - len(fresh))
+            pages += 1
+    finally:
+        # Written even if a later page fails: these papers are claimed, so
+        # other topics skip them and this CSV is their only copy.
+        if rows:
+            csv_buffer = StringIO()
+            pd.DataFrame(rows).to_csv(csv_buffer, index=False)
+            sink.store(generate_key("normalized", topic, f"{suffix}_data.csv"), csv_buffer.getvalue())
+    return len(rows)
 
-    upload_dataframe_to_s3(df_openalex, bucket_name, openalex_csv_key, aws_region)
-    upload_dataframe_to_s3(df_semantic, bucket_name, semantic_csv_key, aws_region)
+def harvest(topics, clients, sink, max_results=1000, workers=8):
+    """Harvest every (topic, API) pair concurrently; the per-API token
+    buckets, not the worker count, set the request rate."""
+    seen = SeenPapers()
+    started = time.perf_counter()
+    failures = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(harvest_topic, client, source, topic, seen, sink, max_results): (source, topic)
+                   for topic in topics for source, client in clients.items()}
+        for future in as_completed(futures):
+            source, topic = futures[future]
+            try:
+                print(f"{source} '{topic}': {future.result()} new papers")
+            except Exception as e:
+                print(f"{source} '{topic}' failed: {e}")
+                failures.append((source, topic))
+    elapsed = time.perf_counter() - started
+    report = {"topics": len(topics), "failed": len(failures), "seconds": round(elapsed, 2)}
+    for source, client in clients.items():
+        stats = dict(client.stats)
+        stats["papers_per_second"] = round(stats.get("papers", 0) / elapsed, 1) if elapsed else 0.0
+        report[source] = stats
+    return report
+
+def load_topics(topics, topics_file):
+    if topics_file:
+        with open(topics_file) as f:
+            return [line.strip() for line in f if line.strip()]
+    return [topic.strip() for topic in topics.split(",") if topic.strip()]
+
+def main():
+    topics = load_topics(os.environ.get("TOPICS", "TOPIC_NAME"), os.environ.get("TOPICS_FILE"))
+    bucket_name = os.environ.get("BUCKET_NAME", "BUCKET_NAME")
+    aws_region = os.environ.get("AWS_REGION", "us-east-1")
+    output_dir = os.environ.get("OUTPUT_DIR")
+    max_results = int(os.environ.get("MAX_RESULTS_PER_TOPIC", "1000"))
+    workers = int(os.environ.get("HARVEST_WORKERS", "8"))
+    # Published limits: OpenAlex allows 10 requests/s; Semantic Scholar 1/s without a key.
+    openalex_rate = float(os.environ.get("OPENALEX_RATE", "10"))
+    semantic_rate = float(os.environ.get("SEMANTIC_SCHOLAR_RATE", "1"))
+
+    openalex_headers = {}
+    if os.environ.get("OPENALEX_MAILTO"):
+        openalex_headers["User-Agent"] = f"SemanticSearch (mailto:{os.environ['OPENALEX_MAILTO']})"
+    semantic_headers = {}
+    if os.environ.get("SEMANTIC_SCHOLAR_API_KEY"):
+        semantic_headers["x-api-key"] = os.environ["SEMANTIC_SCHOLAR_API_KEY"]
+    clients = {
+        "openalex": ApiClient("openalex", OPENALEX_URL, openalex_rate, burst=max(1, int(openalex_rate)),
+                              headers=openalex_headers, pool_size=workers),
+        "semantic": ApiClient("semantic", SEMANTIC_SCHOLAR_URL, semantic_rate, headers=semantic_headers,
+                              pool_size=workers),
+    }
+    sink = LocalSink(output_dir) if output_dir else S3Sink(bucket_name, aws_region)
+    report = harvest(topics, clients, sink, max_results, workers)
+    print(json.dumps(report))
+    return report
 
 if __name__ == "__main__":
     main()
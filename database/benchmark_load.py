@@ -0,0 +1,211 @@
+import json
+import heapq
+import time
+import argparse
+import threading
+import numpy as np
+import pandas as pd
+from cassandra import WriteTimeout
+
+from lambda_function import insert_openalex_data
+
+# Load rate of the row-by-row insert this Lambda used to do against the
+# concurrent bulk loader. By default it runs against an in-process stand-in
+# with a fixed per-request latency and a write-capacity limit, so throttling
+# and retries show up; --host points it at a real local Cassandra instead.
+
+class StandInFuture:
+    # Attributes the driver's concurrent executor reads when wrapping a result.
+    has_more_pages = False
+    _col_names = None
+    _col_types = None
+    _continuous_paging_session = None
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+        self.error = None
+        self.callbacks = []
+
+    def complete(self, error=None):
+        with self.lock:
+            self.error = error
+            self.done.set()
+            callbacks, self.callbacks = self.callbacks, []
+        for callback, errback, args, error_args in callbacks:
+            self._fire(callback, errback, args, error_args)
+
+    def _fire(self, callback, errback, args, error_args):
+        if self.error is not None:
+            errback(self.error, *error_args)
+        else:
+            callback([], *args)
+
+    def add_callbacks(self, callback, errback, callback_args=(), callback_kwargs=None, errback_args=(),
+                      errback_kwargs=None):
+        with self.lock:
+            if not self.done.is_set():
+                self.callbacks.append((callback, errback, callback_args, errback_args))
+                return
+        self._fire(callback, errback, callback_args, errback_args)
+
+    def clear_callbacks(self):
+        with self.lock:
+            self.callbacks = []
+
+    def result(self):
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return []
+
+class StandInStatement:
+    def __init__(self, query_string):
+        self.query_string = query_string
+
+class StandInSession:
+    """Keyspaces-like table: every write takes `latency_ms`, and writes beyond
+    `capacity` per second fail with WriteTimeout, as a throttled table does.
+    With store_rows=False only the write count is kept."""
+
+    def __init__(self, latency_ms, capacity, store_rows=True):
+        self.latency = latency_ms / 1000
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.refilled = time.monotonic()
+        self.store_rows = store_rows
+        self.rows = {}
+        self.writes = 0
+        self.throttled = 0
+        self.lock = threading.Lock()
+        self.due = []
+        self.sequence = 0
+        self.wakeup = threading.Condition(self.lock)
+        threading.Thread(target=self._complete_due, daemon=True).start()
+
+    def prepare(self, query):
+        return StandInStatement(query)
+
+    def _admit(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.refilled) * self.capacity)
+        self.refilled = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def execute_async(self, statement, parameters=None, timeout=None, **kwargs):
+        future = StandInFuture()
+        with self.lock:
+            self.writes += 1
+            error = None
+            if self.capacity and not self._admit():
+                self.throttled += 1
+                error = WriteTimeout("Operation rate exceeds the table's write capacity", consistency=6,
+                                     required_responses=2, received_responses=0, write_type=0)
+            elif self.store_rows:
+                self.rows[parameters[0]] = parameters
+            self.sequence += 1
+            heapq.heappush(self.due, (time.monotonic() + self.latency, self.sequence, future, error))
+            self.wakeup.notify()
+        return future
+
+    def execute(self, statement, parameters=None, timeout=None):
+        return self.execute_async(statement, parameters, timeout).result()
+
+    def _complete_due(self):
+        while True:
+            with self.lock:
+                while not self.due or self.due[0][0] > time.monotonic():
+                    self.wakeup.wait(self.due[0][0] - time.monotonic() if self.due else None)
+                _, _, future, error = heapq.heappop(self.due)
+            future.complete(error)
+
+def connect_local_cassandra(host, port):
+    from cassandra.cluster import Cluster
+
+    session = Cluster([host], port=port).connect()
+    session.execute("CREATE KEYSPACE IF NOT EXISTS research_data "
+                    "WITH replication = {'class': 'SimpleStrategy', 'replication_factor': 1}")
+    session.execute("CREATE TABLE IF NOT EXISTS research_data.openalex "
+                    "(id text PRIMARY KEY, title text, abstract text, publication_year int)")
+    session.set_keyspace("research_data")
+    return session
+
+def synthetic_openalex(count, seed=0):
+    rng = np.random.default_rng(seed)
+    years = rng.integers(1990, 2025, size=count).astype(float)
+    years[rng.random(count) < 0.1] = np.nan
+    abstracts = np.array([f"Abstract of paper {i}. " * int(rng.integers(1, 30)) for i in range(count)], dtype=object)
+    abstracts[rng.random(count) < 0.2] = np.nan
+    return pd.DataFrame({
+        "id": [f"https://openalex.org/W{i:010d}" for i in range(count)],
+        "title": [f"Synthetic paper {i}" for i in range(count)],
+        "abstract": abstracts,
+        "publication_year": years,
+    })
+
+def insert_rowwise(session, df):
+    # The loader this benchmark replaces: one synchronous round trip per row.
+    prepared = session.prepare("INSERT INTO research_data.openalex (id, title, abstract, publication_year) "
+                               "VALUES (?, ?, ?, ?)")
+    started = time.perf_counter()
+    for _, row in df.iterrows():
+        session.execute(prepared, (
+            row.get("id"),
+            row.get("title"),
+            row.get("abstract") if pd.notnull(row.get("abstract")) else None,
+            int(row.get("publication_year")) if pd.notnull(row.get("publication_year")) else None
+        ))
+    elapsed = time.perf_counter() - started
+    return {"rows": len(df), "written": len(df), "seconds": round(elapsed, 3),
+            "rows_per_second": round(len(df) / elapsed, 1)}
+
+def main():
+    parser = argparse.ArgumentParser(description="Row-by-row versus concurrent bulk load into Cassandra.")
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--baseline-rows", type=int, default=2000,
+                        help="rows loaded row by row; that path is slow, so it runs on a prefix")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[16, 64, 256])
+    parser.add_argument("--retries", type=int, default=8)
+    parser.add_argument("--latency-ms", type=float, default=2.0, help="stand-in write latency")
+    parser.add_argument("--capacity", type=int, default=20000,
+                        help="stand-in writes per second before throttling (0 = unlimited)")
+    parser.add_argument("--host", help="load into a real Cassandra at this address instead of the stand-in")
+    parser.add_argument("--port", type=int, default=9042)
+    parser.add_argument("--output", help="write the JSON report to this file")
+    args = parser.parse_args()
+
+    def session_factory():
+        if args.host:
+            return connect_local_cassandra(args.host, args.port)
+        return StandInSession(args.latency_ms, args.capacity)
+
+    df = synthetic_openalex(args.rows)
+    results = []
+
+    session = session_factory()
+    baseline = dict(insert_rowwise(session, df.head(args.baseline_rows)), loader="rowwise")
+    print(json.dumps(baseline))
+    results.append(baseline)
+
+    for concurrency in args.concurrency:
+        session = session_factory()
+        result = dict(insert_openalex_data(session, df, concurrency, args.retries), loader="bulk",
+                      concurrency=concurrency)
+        if isinstance(session, StandInSession):
+            result["stored"] = len(session.rows)
+            result["throttled_writes"] = session.throttled
+        result["speedup"] = round(result["rows_per_second"] / baseline["rows_per_second"], 1)
+        print(json.dumps(result))
+        results.append(result)
+
+    report = {"rows": args.rows, "target": args.host or "stand-in", "latency_ms": args.latency_ms,
+              "capacity": args.capacity, "results": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
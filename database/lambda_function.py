@@ -2,75 +2,212 @@ import os
 import json
 import boto3
 import pandas as pd
-import io
 import ssl
 from cassandra import ConsistencyLevel
 import time
+import random
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from ssl import SSLContext, PROTOCOL_TLSv1_2, CERT_REQUIRED
-from cassandra.cluster import Cluster
-from cassandra import ConsistencyLevel
+from cassandra.cluster import Cluster, NoHostAvailable
+from cassandra import ConsistencyLevel, OperationTimedOut, Unavailable, WriteFailure, WriteTimeout
 from cassandra.auth import PlainTextAuthProvider
+from cassandra.concurrent import execute_concurrent_with_args
+from cassandra.protocol import OverloadedErrorMessage, ServerError
+
+def s3_client(aws_region="us-east-1"):
+    # S3_ENDPOINT_URL points the loader at a local S3 stand-in (moto, MinIO) for testing.
+    return boto3.client('s3', region_name=aws_region, endpoint_url=os.environ.get("S3_ENDPOINT_URL") or None)
 
-def list_csv_keys(bucket_name, prefix, aws_region="us-east-1"):
-    s3 = boto3.client('s3', region_name=aws_region)
+def list_csv_objects(s3, bucket_name, prefix):
     paginator = s3.get_paginator('list_objects_v2')
-    keys = []
+    objects = []
     for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
         for obj in page.get("Contents", []):
             key = obj["Key"]
             if key.endswith(".csv"):
-                keys.append(key)
-    return keys
+                objects.append((key, obj["ETag"]))
+    return objects
+
+def read_csv_chunks(s3, bucket_name, key, etag, chunk_rows=5000, skip_rows=0):
+    """Parse the object straight off the response stream, `chunk_rows` at a time.
+
+    IfMatch makes the read fail if the object was replaced after it was
+    listed. Resuming at `skip_rows` still streams the skipped rows, but
+    nothing is held in memory beyond the current chunk.
+    """
+    obj = s3.get_object(Bucket=bucket_name, Key=key, IfMatch=etag)
+    skip = range(1, skip_rows + 1) if skip_rows else None
+    yield from pd.read_csv(obj['Body'], chunksize=chunk_rows, skiprows=skip)
+
+class IngestManifest:
+    """Progress per CSV key, one small JSON object per key under `prefix`:
+    the ETag being loaded, rows written so far and whether the file is done."""
+
+    def __init__(self, s3, bucket_name, prefix):
+        self.s3 = s3
+        self.bucket_name = bucket_name
+        self.prefix = prefix
+
+    def manifest_key(self, key):
+        return f"{self.prefix}{key}.json"
+
+    def load(self, key):
+        try:
+            obj = self.s3.get_object(Bucket=self.bucket_name, Key=self.manifest_key(key))
+        except self.s3.exceptions.NoSuchKey:
+            return None
+        return json.loads(obj['Body'].read())
+
+    def save(self, key, etag, rows, complete):
+        body = json.dumps({"etag": etag, "rows": rows, "complete": complete, "updated": time.time()})
+        self.s3.put_object(Bucket=self.bucket_name, Key=self.manifest_key(key), Body=body.encode('utf-8'))
 
-def read_csv_from_s3(bucket_name, key, aws_region="us-east-1"):
-    s3 = boto3.client('s3', region_name=aws_region)
-    obj = s3.get_object(Bucket=bucket_name, Key=key)
-    data = obj['Body'].read().decode('utf-8')
-    df = pd.read_csv(io.StringIO(data))
-    return df
+# Errors Keyspaces returns when a table's write capacity is exceeded or a
+# node is briefly unreachable; these are retried, anything else fails the row.
+RETRYABLE_WRITE_ERRORS = (WriteTimeout, WriteFailure, Unavailable, OperationTimedOut, OverloadedErrorMessage,
+                          ServerError, NoHostAvailable)
 
-def insert_openalex_data(session, df):
+def text_column(df, name):
+    if name not in df:
+        return [None] * len(df)
+    column = df[name]
+    return column.astype(str).astype(object).where(column.notna(), None).tolist()
+
+def year_column(df, name):
+    if name not in df:
+        return [None] * len(df)
+    years = np.trunc(pd.to_numeric(df[name], errors="coerce")).astype("Int64").astype(object)
+    return years.where(years.notna(), None).tolist()
+
+def openalex_rows(df):
+    return list(zip(text_column(df, "id"), text_column(df, "title"), text_column(df, "abstract"),
+                    year_column(df, "publication_year")))
+
+def semantic_rows(df):
+    paperid = "paperid" if "paperid" in df else "paperId"
+    return list(zip(text_column(df, paperid), text_column(df, "title"), text_column(df, "abstract"),
+                    year_column(df, "year"), text_column(df, "authors")))
+
+def bulk_insert(session, query, rows, concurrency=100, max_retries=5, backoff_seconds=0.2):
+    """Write rows with at most `concurrency` requests in flight.
+
+    Rows without a key are skipped. Throttled writes are retried with
+    exponential backoff and jitter; the stats count rows written, skipped,
+    retried and failed, and the load rate.
+    """
+    started = time.perf_counter()
+    prepared = session.prepare(query)
+    pending = [row for row in rows if row[0] is not None]
+    stats = {"rows": len(rows), "written": 0, "skipped": len(rows) - len(pending), "retried": 0, "failed": 0}
+    first_error = None
+    for attempt in range(max_retries + 1):
+        if attempt:
+            time.sleep(backoff_seconds * 2 ** (attempt - 1) * (0.5 + random.random()))
+            stats["retried"] += len(pending)
+        results = execute_concurrent_with_args(session, prepared, pending, concurrency=concurrency,
+                                               raise_on_first_error=False)
+        throttled = []
+        for row, (success, result) in zip(pending, results):
+            if success:
+                stats["written"] += 1
+            elif isinstance(result, RETRYABLE_WRITE_ERRORS) and attempt < max_retries:
+                throttled.append(row)
+            else:
+                stats["failed"] += 1
+                first_error = first_error or f"{row[0]}: {result}"
+        pending = throttled
+        if not pending:
+            break
+    elapsed = time.perf_counter() - started
+    stats["seconds"] = round(elapsed, 3)
+    stats["rows_per_second"] = round(stats["written"] / elapsed, 1) if elapsed else 0.0
+    if stats["failed"]:
+        raise RuntimeError(f"{stats['failed']} of {stats['rows']} rows failed to load (first: {first_error})")
+    return stats
+
+def insert_openalex_data(session, df, concurrency=100, max_retries=5):
     query = """
         INSERT INTO research_data.openalex (id, title, abstract, publication_year)
         VALUES (?, ?, ?, ?)
     """
-    prepared = session.prepare(query)
-    for _, row in df.iterrows():
-        session.execute(prepared, (
-            row.get("id"),
-            row.get("title"),
-            row.get("abstract") if pd.notnull(row.get("abstract")) else None,
-            int(row.get("publication_year")) if pd.notnull(row.get("publication_year")) else None
-        ))
-
-def insert_semantic_data(session, df):
+    return bulk_insert(session, query, openalex_rows(df), concurrency, max_retries)
+
+def insert_semantic_data(session, df, concurrency=100, max_retries=5):
     query = """
         INSERT INTO research_data.semantic_scholar (paperid, title, abstract, year, authors)
         VALUES (?, ?, ?, ?, ?)
     """
-    prepared = session.prepare(query)
-    for _, row in df.iterrows():
-        paperid = row.get("paperid") if "paperid" in row else row.get("paperId")
-        title = row.get("title") if pd.notnull(row.get("title")) else None
-        abstract = row.get("abstract") if pd.notnull(row.get("abstract")) else None
-        year = int(row.get("year")) if pd.notnull(row.get("year")) else None
-        authors = row.get("authors") if pd.notnull(row.get("authors")) else None
+    return bulk_insert(session, query, semantic_rows(df), concurrency, max_retries)
 
-        session.execute(prepared, (paperid, title, abstract, year, authors))
 
+CSV_LOADERS = (
+    ("openalex_data.csv", insert_openalex_data),
+    ("semantic_data.csv", insert_semantic_data),
+)
 
-def main():
-    bucket_name = os.environ.get("BUCKET_NAME", "BUCKET_NAME")
-    aws_region = os.environ.get("AWS_REGION", "us-east-1")
-    normalized_prefix = os.environ.get("NORMALIZED_PREFIX", "normalized/")
-    keyspaces_endpoint = os.environ.get("KEYSPACES_ENDPOINT", "cassandra.us-east-2.amazonaws.com")
-    service_username = os.environ.get("SERVICE_USERNAME")
-    service_password = os.environ.get("SERVICE_PASSWORD")
-    cert_path = os.environ.get("CERT_PATH", "/var/task/sf-class2-root.crt")
+def loader_for(key):
+    return next((insert for suffix, insert in CSV_LOADERS if suffix in key), None)
 
-    csv_keys = list_csv_keys(bucket_name, normalized_prefix, aws_region)
-    print("Found CSV files:", csv_keys)
+def ingest_key(session, s3, bucket_name, key, etag, manifest, chunk_rows=5000, concurrency=100, max_retries=5,
+               deadline=None):
+    insert = loader_for(key)
+    if insert is None:
+        print(f"Unknown file type for key {key}; skipping.")
+        return {"key": key, "status": "unknown"}
+    entry = manifest.load(key)
+    if entry and entry["etag"] == etag and entry["complete"]:
+        return {"key": key, "status": "done", "rows": entry["rows"]}
+    # A checkpoint for an older version of the file does not apply; start over.
+    start_row = entry["rows"] if entry and entry["etag"] == etag else 0
+    if start_row:
+        print(f"Resuming {key} at row {start_row}.")
+    rows = start_row
+    written = 0
+    started = time.perf_counter()
+    for chunk in read_csv_chunks(s3, bucket_name, key, etag, chunk_rows, start_row):
+        if deadline is not None and time.monotonic() > deadline:
+            return {"key": key, "status": "paused", "rows": rows}
+        stats = insert(session, chunk, concurrency, max_retries)
+        rows += len(chunk)
+        written += stats["written"]
+        manifest.save(key, etag, rows, complete=False)
+    manifest.save(key, etag, rows, complete=True)
+    elapsed = time.perf_counter() - started
+    return {"key": key, "status": "loaded", "rows": rows, "written": written,
+            "rows_per_second": round(written / elapsed, 1) if elapsed else 0.0}
 
+def ingest(session, s3, bucket_name, prefix, manifest_prefix, key_workers=4, chunk_rows=5000, concurrency=100,
+           max_retries=5, deadline=None):
+    """Load every CSV under `prefix`, `key_workers` files at a time.
+
+    Files whose ETag is recorded as complete are skipped; a file left part
+    way (by an error or by reaching `deadline`) resumes from its checkpoint
+    on the next run. Keyspaces sees up to key_workers * concurrency writes
+    in flight.
+    """
+    objects = list_csv_objects(s3, bucket_name, prefix)
+    print("Found CSV files:", [key for key, _ in objects])
+    manifest = IngestManifest(s3, bucket_name, manifest_prefix)
+    results = []
+    errors = []
+    with ThreadPoolExecutor(max_workers=key_workers) as pool:
+        futures = {pool.submit(ingest_key, session, s3, bucket_name, key, etag, manifest, chunk_rows, concurrency,
+                               max_retries, deadline): key for key, etag in objects}
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"Failed to load {futures[future]}: {e}")
+                errors.append(e)
+                continue
+            print(f"{result['key']}: {json.dumps(result)}")
+            results.append(result)
+    if errors:
+        raise errors[0]
+    return results
+
+def connect_keyspaces(keyspaces_endpoint, service_username, service_password, cert_path):
     ssl_context = ssl.create_default_context()
     ssl_context.load_verify_locations(cert_path)
     ssl_context.verify_mode = ssl.CERT_REQUIRED
@@ -96,23 +233,46 @@ def main():
     session.set_keyspace("research_data")
 
     session.default_consistency_level = ConsistencyLevel.LOCAL_QUORUM
+    return session
+
+def main(deadline=None):
+    bucket_name = os.environ.get("BUCKET_NAME", "BUCKET_NAME")
+    aws_region = os.environ.get("AWS_REGION", "us-east-1")
+    normalized_prefix = os.environ.get("NORMALIZED_PREFIX", "normalized/")
+    manifest_prefix = os.environ.get("MANIFEST_PREFIX", "manifests/ingest/")
+    keyspaces_endpoint = os.environ.get("KEYSPACES_ENDPOINT", "cassandra.us-east-2.amazonaws.com")
+    service_username = os.environ.get("SERVICE_USERNAME")
+    service_password = os.environ.get("SERVICE_PASSWORD")
+    cert_path = os.environ.get("CERT_PATH", "/var/task/sf-class2-root.crt")
+    write_concurrency = int(os.environ.get("WRITE_CONCURRENCY", "100"))
+    write_retries = int(os.environ.get("WRITE_RETRIES", "5"))
+    key_workers = int(os.environ.get("KEY_WORKERS", "4"))
+    chunk_rows = int(os.environ.get("CSV_CHUNK_ROWS", "5000"))
 
-    for key in csv_keys:
-        print("Processing file:", key)
-        df = read_csv_from_s3(bucket_name, key, aws_region)
-        if "openalex_data.csv" in key:
-            print("Inserting OpenAlex data...")
-            insert_openalex_data(session, df)
-        elif "semantic_data.csv" in key:
-            print("Inserting Semantic Scholar data...")
-            insert_semantic_data(session, df)
-        else:
-            print(f"Unknown file type for key {key}; skipping.")
-    print("All data insertion complete.")
+    session = connect_keyspaces(keyspaces_endpoint, service_username, service_password, cert_path)
+    results = ingest(session, s3_client(aws_region), bucket_name, normalized_prefix, manifest_prefix, key_workers,
+                     chunk_rows, write_concurrency, write_retries, deadline)
+    paused = [result["key"] for result in results if result["status"] == "paused"]
+    if paused:
+        print(f"Stopped before the timeout with {len(paused)} files part-loaded; the next run resumes them.")
+    else:
+        print("All data insertion complete.")
+    return paused
 
 def lambda_handler(event, context):
+    # Stop starting new chunks this long before the Lambda timeout, so the
+    # checkpoint of the chunk in flight is saved.
+    margin = float(os.environ.get("TIMEOUT_MARGIN_SECONDS", "60"))
+    deadline = None
+    if context is not None and hasattr(context, "get_remaining_time_in_millis"):
+        deadline = time.monotonic() + context.get_remaining_time_in_millis() / 1000 - margin
     try:
-        main()
+        paused = main(deadline)
+        if paused:
+            return {
+                'statusCode': 200,
+                'body': json.dumps(f'Partially loaded; re-run to resume {len(paused)} files.')
+            }
         return {
             'statusCode': 200,
             'body': json.dumps('All CSV data inserted successfully into AWS Keyspaces!')
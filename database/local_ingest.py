@@ -0,0 +1,115 @@
+import os
+import io
+import json
+import time
+import argparse
+import threading
+import numpy as np
+
+from benchmark_load import StandInSession, synthetic_openalex
+from lambda_function import IngestManifest, ingest, s3_client
+
+# Runs the loader end to end against a local S3 stand-in (S3_ENDPOINT_URL,
+# e.g. `moto_server -p 5000` or MinIO) and the in-process Keyspaces stand-in:
+# uploads synthetic CSVs, loads them with a deadline short enough to stop
+# part way, then re-runs until everything is loaded, checking that the
+# reruns resume instead of starting over and that a final run skips it all.
+
+def openalex_file(count, part):
+    df = synthetic_openalex(count, seed=part)
+    df["id"] = [f"https://openalex.org/W{part:03d}{i:07d}" for i in range(count)]
+    return df
+
+def semantic_file(count, part):
+    rng = np.random.default_rng(part)
+    df = synthetic_openalex(count, part).rename(columns={"id": "paperId", "publication_year": "year"})
+    df["paperId"] = [f"{part:08x}{i:032x}" for i in range(count)]
+    df["authors"] = [", ".join(f"Author {a}" for a in rng.integers(0, 500, size=3)) for _ in range(count)]
+    return df
+
+def resident_mib():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+
+class MemorySampler(threading.Thread):
+    """Highest resident memory seen while loading, sampled every 50 ms."""
+
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.peak = resident_mib()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(0.05):
+            self.peak = max(self.peak, resident_mib())
+
+def upload_csv(s3, bucket_name, key, df):
+    buffer = io.BytesIO()
+    df.to_csv(buffer, index=False)
+    s3.put_object(Bucket=bucket_name, Key=key, Body=buffer.getvalue())
+    return buffer.tell()
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end loader run against local S3 and Keyspaces stand-ins.")
+    parser.add_argument("--bucket", default="semantic-search-local")
+    parser.add_argument("--files", type=int, default=4, help="CSV files per source")
+    parser.add_argument("--rows", type=int, default=20000, help="rows per file")
+    parser.add_argument("--chunk-rows", type=int, default=2000)
+    parser.add_argument("--key-workers", type=int, default=4)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--latency-ms", type=float, default=2.0)
+    parser.add_argument("--first-run-seconds", type=float, default=1.0,
+                        help="deadline for the first run, so it stops part way like a timed-out Lambda")
+    args = parser.parse_args()
+
+    if not os.environ.get("S3_ENDPOINT_URL"):
+        parser.error("set S3_ENDPOINT_URL to the local S3 stand-in, e.g. http://127.0.0.1:5000")
+    s3 = s3_client()
+    s3.create_bucket(Bucket=args.bucket)
+    uploaded = 0
+    for i in range(args.files):
+        uploaded += upload_csv(s3, args.bucket, f"normalized/part-{i}/openalex_data.csv",
+                               openalex_file(args.rows, i))
+        uploaded += upload_csv(s3, args.bucket, f"normalized/part-{i}/semantic_data.csv",
+                               semantic_file(args.rows, i))
+    print(f"Uploaded {2 * args.files} files, {uploaded / 2**20:.1f} MiB")
+
+    # Rows are not kept, so the memory figure is the loader's alone.
+    session = StandInSession(args.latency_ms, 0, store_rows=False)
+    baseline_mib = resident_mib()
+    sampler = MemorySampler()
+    sampler.start()
+    runs = []
+    deadline_seconds = args.first_run_seconds
+    # Runs until nothing is paused, then once more, which should skip every file.
+    while not runs or runs[-1]["statuses"]["done"] < 2 * args.files:
+        started = time.perf_counter()
+        deadline = time.monotonic() + deadline_seconds if deadline_seconds else None
+        results = ingest(session, s3, args.bucket, "normalized/", "manifests/ingest/", args.key_workers,
+                         args.chunk_rows, args.concurrency, 5, deadline)
+        runs.append({
+            "seconds": round(time.perf_counter() - started, 2),
+            "statuses": {status: sum(result["status"] == status for result in results)
+                         for status in ("loaded", "paused", "done")},
+            "writes": session.writes,
+        })
+        deadline_seconds = None
+    sampler.stopped.set()
+
+    manifest = IngestManifest(s3, args.bucket, "manifests/ingest/")
+    expected = 2 * args.files * args.rows
+    report = {
+        "rows_expected": expected,
+        # Rows written more than once: the chunk in flight when a run stopped.
+        "rows_rewritten": session.writes - expected,
+        "manifest_rows": sum(manifest.load(key)["rows"] for key in
+                             (f"normalized/part-{i}/{name}" for i in range(args.files)
+                              for name in ("openalex_data.csv", "semantic_data.csv"))),
+        # Should stay flat as --rows grows: only one chunk per worker is parsed at a time.
+        "load_memory_growth_mib": round(sampler.peak - baseline_mib, 1),
+        "runs": runs,
+    }
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+import json
+import time
+import argparse
+import numpy as np
+
+from embedding import EncodingEngine
+
+# Documents/second for the embedding job's encoder across worker counts and
+# batch sizes, on a synthetic corpus whose lengths are spread like the real
+# one: titles alone, titles with short abstracts, and long abstracts with
+# author lists. Every configuration is checked against the first one, so a
+# bug in putting batches back in input order shows up as drift.
+
+WORDS = ("model learning data network protein climate graph attention retrieval quantum genome matter "
+         "language federated vaccine battery inference causal sparse dense transformer optimisation "
+         "simulation observational structure prediction efficiency evaluation benchmark analysis").split()
+
+def synthetic_documents(count, seed=0):
+    rng = np.random.default_rng(seed)
+    docs = []
+    for _ in range(count):
+        title = " ".join(rng.choice(WORDS, size=rng.integers(4, 14)))
+        # About a fifth of records have no abstract; the rest are log-normal in length.
+        words = 0 if rng.random() < 0.2 else int(min(rng.lognormal(4.8, 0.6), 600))
+        abstract = " ".join(rng.choice(WORDS, size=words))
+        authors = ", ".join(f"Author {rng.integers(1000)}" for _ in range(rng.integers(0, 8)))
+        docs.append(" ".join(part for part in (title, abstract, authors) if part))
+    return docs
+
+def benchmark(args, texts, workers, batch_size, sort_by_length):
+    started = time.perf_counter()
+    engine = EncodingEngine(args.model, args.backend, args.threads, args.model_dir,
+                            workers=workers, batch_size=batch_size, sort_by_length=sort_by_length)
+    try:
+        engine.encode(texts[:workers * batch_size or batch_size])
+        startup_seconds = time.perf_counter() - started
+
+        vectors = []
+        started = time.perf_counter()
+        # Encode in windows the size of the job's ENCODE_BATCH_SIZE, the span length sorting works over.
+        for start in range(0, len(texts), args.window):
+            vectors.append(engine.encode(texts[start:start + args.window]))
+        elapsed = time.perf_counter() - started
+    finally:
+        engine.close()
+    return np.vstack(vectors), {
+        "workers": workers,
+        "batch_size": batch_size,
+        "sort_by_length": sort_by_length,
+        "startup_seconds": round(startup_seconds, 3),
+        "elapsed_seconds": round(elapsed, 3),
+        "docs_per_second": round(len(texts) / elapsed, 1),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput benchmark for the embedding job's encoder.")
+    parser.add_argument("--model", default="all-MiniLM-L6-v2")
+    parser.add_argument("--backend", default="torch", choices=["torch", "onnx", "onnx-int8"])
+    parser.add_argument("--model-dir", default="/app/models")
+    parser.add_argument("--count", type=int, default=4000, help="synthetic documents to encode")
+    parser.add_argument("--workers", type=int, nargs="+", default=[0, 2, 4],
+                        help="worker process counts to compare (0 = encode in-process)")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[16, 32, 64])
+    parser.add_argument("--threads", type=int, default=0, help="threads per encoder (0 = split the cores)")
+    parser.add_argument("--window", type=int, default=1024, help="documents per encode() call")
+    parser.add_argument("--unsorted", action="store_true", help="also run each configuration without length sorting")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the JSON report to this file")
+    args = parser.parse_args()
+
+    texts = synthetic_documents(args.count, args.seed)
+    lengths = np.array([len(text) for text in texts])
+    print(f"Encoding {len(texts)} documents, {lengths.mean():.0f} characters on average "
+          f"(p50 {np.percentile(lengths, 50):.0f}, p99 {np.percentile(lengths, 99):.0f})")
+
+    reference = None
+    results = []
+    for workers in args.workers:
+        for batch_size in args.batch_sizes:
+            for sort_by_length in ([True, False] if args.unsorted else [True]):
+                vectors, result = benchmark(args, texts, workers, batch_size, sort_by_length)
+                vectors = vectors / (np.linalg.norm(vectors, axis=1, keepdims=True) + 1e-10)
+                if reference is None:
+                    reference = vectors
+                result["max_cosine_drift"] = round(float(np.max(1.0 - np.sum(vectors * reference, axis=1))), 6)
+                print(json.dumps(result))
+                results.append(result)
+
+    best = max(results, key=lambda result: result["docs_per_second"])
+    report = {"model": args.model, "backend": args.backend, "documents": len(texts),
+              "mean_characters": round(float(lengths.mean()), 1), "window": args.window,
+              "best": best, "results": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -3,12 +3,21 @@ import json
 import ssl
 import io
 import time
+import queue
+import struct
+import hashlib
+import resource
+import multiprocessing
+import threading
+from array import array
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 import pandas as pd
 import boto3
 from cassandra.cluster import Cluster
+from cassandra.query import SimpleStatement
 from cassandra.auth import PlainTextAuthProvider
-from cassandra import ConsistencyLevel
+from cassandra import ConsistencyLevel, InvalidRequest
 from sentence_transformers import SentenceTransformer
 
 def list_csv_keys(bucket_name, prefix, aws_region="us-east-1"):
@@ -59,45 +68,403 @@ def insert_semantic_data(session, df):
             row.get("authors")
         ))
 
-def fetch_openalex_documents(session):
-    query = "SELECT id, title, abstract FROM openalex"
-    rows = session.execute(query)
-    docs = []
-    for row in rows:
-        text = ""
-        if row.title:
-            text += row.title
-        if row.abstract:
-            text += " " + row.abstract
-        docs.append({'id': row.id, 'text': text})
-    return docs
-
-def fetch_semantic_documents(session):
-    query = "SELECT paperid, title, abstract, authors FROM semantic_scholar"
-    rows = session.execute(query)
-    docs = []
+def document_key(source, doc_id):
+    return int.from_bytes(hashlib.blake2b(f"{source}\0{doc_id}".encode('utf-8'), digest_size=8).digest(), "little")
+
+def content_hash(text):
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=8).hexdigest()
+
+class StoredHashes:
+    """Content hashes of the embeddings already stored for one model, kept
+    as two sorted uint64 arrays (16 bytes per document)."""
+
+    def __init__(self, keys, hashes):
+        keys = np.frombuffer(keys, dtype=np.uint64)
+        hashes = np.frombuffer(hashes, dtype=np.uint64)
+        order = np.argsort(keys)
+        self.keys = keys[order]
+        self.hashes = hashes[order]
+
+    def __len__(self):
+        return len(self.keys)
+
+    def unchanged(self, keys, hashes):
+        keys = np.asarray(keys, dtype=np.uint64)
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        if not len(self.keys):
+            return np.zeros(len(keys), dtype=bool)
+        positions = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+        return (self.keys[positions] == keys) & (self.hashes[positions] == hashes)
+
+def table_status(session, keyspace, table):
+    try:
+        row = session.execute("SELECT status FROM system_schema_mcs.tables WHERE keyspace_name = %s "
+                              "AND table_name = %s", (keyspace, table)).one()
+    except InvalidRequest:
+        # Not Keyspaces (e.g. a local Cassandra): schema changes apply synchronously.
+        return "ACTIVE"
+    return row.status if row is not None else "ACTIVE"
+
+def wait_for_columns(session, keyspace, table, columns, timeout=300, poll_seconds=2):
+    """Keyspaces applies ALTER TABLE asynchronously; wait until the table is
+    ACTIVE again and the driver sees the new columns before using them."""
+    deadline = time.monotonic() + timeout
+    while True:
+        if table_status(session, keyspace, table) == "ACTIVE":
+            session.cluster.refresh_table_metadata(keyspace, table)
+            known = session.cluster.metadata.keyspaces[keyspace].tables[table].columns
+            if all(column in known for column in columns):
+                return
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"{keyspace}.{table} did not show columns {columns} within {timeout}s")
+        time.sleep(poll_seconds)
+
+def ensure_embedding_columns(session):
+    table = session.cluster.metadata.keyspaces["research_data"].tables["document_embeddings"]
+    missing = [column for column in ("content_hash", "model_id") if column not in table.columns]
+    for column in missing:
+        print(f"Adding column document_embeddings.{column}...")
+        session.execute(f"ALTER TABLE research_data.document_embeddings ADD {column} text")
+        # Keyspaces rejects a second ALTER while the table is still updating.
+        wait_for_columns(session, "research_data", "document_embeddings", [column])
+
+def load_stored_hashes(session, model_id, fetch_size=1000):
+    rows = session.execute(SimpleStatement("SELECT source, id, content_hash, model_id FROM document_embeddings",
+                                           fetch_size=fetch_size))
+    keys = array('Q')
+    hashes = array('Q')
     for row in rows:
-        text = ""
-        if row.title:
-            text += row.title
-        if row.abstract:
-            text += " " + row.abstract
-        if row.authors:
-            text += " " + row.authors
-        docs.append({'id': row.paperid, 'text': text})
-    return docs
-
-def compute_embeddings_for_docs(docs, model):
-    texts = [doc['text'] for doc in docs]
-    embeddings = model.encode(texts, convert_to_numpy=True)
-    return [(doc['id'], emb) for doc, emb in zip(docs, embeddings)]
-
-def store_embeddings(session, embeddings, source):
-    query = "INSERT INTO document_embeddings (id, source, embedding) VALUES (?, ?, ?)"
-    prepared = session.prepare(query)
-    for doc_id, emb in embeddings:
-        emb_bytes = emb.tobytes()
-        session.execute(prepared, (doc_id, source, emb_bytes))
+        if row.content_hash and row.model_id == model_id:
+            keys.append(document_key(row.source, row.id))
+            hashes.append(int(row.content_hash, 16))
+    return StoredHashes(keys, hashes)
+
+def select_changed_documents(docs, source, stored):
+    """Drop documents whose stored embedding was made from the same text by the same model."""
+    if not docs:
+        return docs
+    keys = [document_key(source, doc['id']) for doc in docs]
+    hashes = [int(doc['hash'], 16) for doc in docs]
+    unchanged = stored.unchanged(keys, hashes)
+    return [doc for doc, skip in zip(docs, unchanged) if not skip]
+
+def openalex_document(row):
+    text = ""
+    if row.title:
+        text += row.title
+    if row.abstract:
+        text += " " + row.abstract
+    return {'id': row.id, 'text': text, 'hash': content_hash(text)}
+
+def semantic_document(row):
+    text = ""
+    if row.title:
+        text += row.title
+    if row.abstract:
+        text += " " + row.abstract
+    if row.authors:
+        text += " " + row.authors
+    return {'id': row.paperid, 'text': text, 'hash': content_hash(text)}
+
+DOCUMENT_SOURCES = {
+    "openalex": ("SELECT id, title, abstract FROM openalex", openalex_document),
+    "semantic": ("SELECT paperid, title, abstract, authors FROM semantic_scholar", semantic_document),
+}
+
+class StageMeter:
+    """Items handled and seconds spent busy in one pipeline stage."""
+
+    def __init__(self, name):
+        self.name = name
+        self.items = 0
+        self.seconds = 0.0
+        self.lock = threading.Lock()
+
+    def add(self, items, seconds):
+        with self.lock:
+            self.items += items
+            self.seconds += seconds
+
+    def summary(self):
+        rate = self.items / self.seconds if self.seconds else 0.0
+        return f"{self.name}: {self.items} in {self.seconds:.1f}s busy ({rate:.0f}/s)"
+
+def read_document_batches(session, stored, batch_size, fetch_size, batches, meters):
+    """Page through the source tables and queue batches of changed documents.
+
+    Runs on its own thread so the next page is fetched while the previous
+    batch is encoded; the bounded queue stops it from running ahead.
+    """
+    try:
+        for source, (query, to_document) in DOCUMENT_SOURCES.items():
+            rows = session.execute(SimpleStatement(query, fetch_size=fetch_size))
+            pending = []
+            started = time.perf_counter()
+            for row in rows:
+                pending.append(to_document(row))
+                if len(pending) == batch_size:
+                    queue_changed_documents(source, pending, stored, batches, meters, started)
+                    pending = []
+                    started = time.perf_counter()
+            if pending:
+                queue_changed_documents(source, pending, stored, batches, meters, started)
+        batches.put(None)
+    except Exception as e:
+        batches.put(e)
+
+def queue_changed_documents(source, docs, stored, batches, meters, started):
+    changed = select_changed_documents(docs, source, stored)
+    meters["fetch"].add(len(docs), time.perf_counter() - started)
+    meters["skip"].add(len(docs) - len(changed), 0.0)
+    if changed:
+        blocked = time.perf_counter()
+        batches.put((source, changed))
+        meters["fetch_blocked"].add(1, time.perf_counter() - blocked)
+
+# Copied from rag/app.py, which encodes queries; keep onnx_model_path and
+# load_sentence_encoder identical in both files, and run the job with the
+# service's backend, or document and query vectors drift apart (see
+# rag/benchmark_encoder.py).
+def onnx_model_path(model_name, backend, model_dir, quantization="avx2"):
+    """Export the model to ONNX (and quantize it for onnx-int8) once, returning
+    the local directory and the graph file to load from it."""
+    path = os.path.join(model_dir, model_name.replace("/", "__") + "-onnx")
+    file_name = "onnx/model.onnx" if backend == "onnx" else f"onnx/model_qint8_{quantization}.onnx"
+    if os.path.exists(os.path.join(path, file_name)):
+        return path, file_name
+    if not os.path.exists(os.path.join(path, "onnx", "model.onnx")):
+        SentenceTransformer(model_name, backend="onnx").save_pretrained(path)
+    if backend == "onnx-int8":
+        from sentence_transformers import export_dynamic_quantized_onnx_model
+        export_dynamic_quantized_onnx_model(SentenceTransformer(path, backend="onnx"), quantization, path)
+    return path, file_name
+
+def load_sentence_encoder(model_name, backend="torch", threads=0, model_dir="/app/models", quantization="avx2"):
+    if backend == "torch":
+        if threads:
+            import torch
+            torch.set_num_threads(threads)
+        return SentenceTransformer(model_name)
+    if backend not in ("onnx", "onnx-int8"):
+        raise ValueError(f"Unknown embedding backend {backend!r}")
+    import onnxruntime
+    path, file_name = onnx_model_path(model_name, backend, model_dir, quantization)
+    session_options = onnxruntime.SessionOptions()
+    if threads:
+        session_options.intra_op_num_threads = threads
+        session_options.inter_op_num_threads = 1
+    return SentenceTransformer(path, backend="onnx", model_kwargs={
+        "file_name": file_name,
+        "provider": "CPUExecutionProvider",
+        "session_options": session_options,
+    })
+
+_worker_model = None
+
+def _start_encoder_worker(model_args):
+    global _worker_model
+    _worker_model = load_sentence_encoder(*model_args)
+
+def _encode_batch(texts):
+    return _worker_model.encode(texts, convert_to_numpy=True, batch_size=len(texts))
+
+class EncodingEngine:
+    """Encodes texts in length-sorted batches, in-process or across worker processes.
+
+    A batch is padded to its longest text, so mixing a bare title with a long
+    abstract wastes most of the work on padding. Texts are sorted longest
+    first (characters, the same length proxy SentenceTransformer sorts by),
+    cut into batches of `batch_size`, encoded, and put back in input order.
+    With `workers` > 0 each worker process loads its own model with
+    `threads` intra-op threads (default: the cores split between workers).
+    """
+
+    def __init__(self, model_name, backend="torch", threads=0, model_dir="/app/models", quantization="avx2",
+                 workers=0, batch_size=32, sort_by_length=True):
+        self.batch_size = batch_size
+        self.workers = workers
+        self.sort_by_length = sort_by_length
+        self.pool = None
+        self.model = None
+        if workers:
+            threads = threads or max(1, (os.cpu_count() or 1) // workers)
+            model_args = (model_name, backend, threads, model_dir, quantization)
+            # spawn, not fork: torch and onnxruntime thread pools do not survive a fork.
+            context = multiprocessing.get_context("spawn")
+            # A worker that fails to load the model breaks the executor, so the job fails instead of respawning.
+            self.pool = ProcessPoolExecutor(workers, mp_context=context, initializer=_start_encoder_worker,
+                                            initargs=(model_args,))
+        else:
+            self.model = load_sentence_encoder(model_name, backend, threads, model_dir, quantization)
+
+    def batches(self, texts):
+        order = np.arange(len(texts))
+        if self.sort_by_length:
+            lengths = np.fromiter((len(text) for text in texts), dtype=np.int64, count=len(texts))
+            order = np.argsort(-lengths, kind="stable")
+        return [order[start:start + self.batch_size] for start in range(0, len(order), self.batch_size)]
+
+    def encode(self, texts):
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        batches = self.batches(texts)
+        batch_texts = [[texts[i] for i in batch] for batch in batches]
+        if self.pool is not None:
+            # Longest batches go out first, so the short tail evens out the workers.
+            results = self.pool.map(_encode_batch, batch_texts)
+        else:
+            results = (self.model.encode(chunk, convert_to_numpy=True, batch_size=len(chunk))
+                       for chunk in batch_texts)
+        embeddings = None
+        for batch, vectors in zip(batches, results):
+            if embeddings is None:
+                embeddings = np.empty((len(texts), vectors.shape[1]), dtype=np.float32)
+            embeddings[batch] = vectors
+        return embeddings
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+def compute_embeddings_for_docs(docs, engine):
+    return engine.encode([doc['text'] for doc in docs])
+
+# Blob layout read by rag/app.py (decode_embedding_blob); keep the two in step.
+BLOB_MAGIC = b"EB\xc0\x7f"
+BLOB_VERSION = 1
+BLOB_HEADER = struct.Struct("<4sBBHff")
+BLOB_DTYPES = {0: np.float32, 1: np.float16, 2: np.int8}
+BLOB_FORMATS = {"float32": 0, "float16": 1, "int8": 2}
+
+def encode_embedding_blobs(embeddings, blob_format="float16", model_id=""):
+    """Normalize each vector and pack it behind a versioned header.
+
+    "raw" writes the old headerless float32 bytes, for readers that predate
+    the header.
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    if blob_format == "raw":
+        return [vector.tobytes() for vector in embeddings]
+    if blob_format not in BLOB_FORMATS:
+        raise ValueError(f"Unknown embedding blob format {blob_format!r}")
+    norms = np.linalg.norm(embeddings, axis=1)
+    unit = embeddings / (norms[:, None] + 1e-10)
+    scales = np.ones(len(unit), dtype=np.float32)
+    if blob_format == "int8":
+        # Per-vector scale, so the largest component maps to +/-127.
+        scales = np.abs(unit).max(axis=1) / 127
+        scales[scales == 0] = 1.0
+        unit = np.round(unit / scales[:, None])
+    payload = unit.astype(BLOB_DTYPES[BLOB_FORMATS[blob_format]])
+    model = model_id.encode('utf-8')[:255]
+    suffix = bytes([len(model)]) + model
+    return [BLOB_HEADER.pack(BLOB_MAGIC, BLOB_VERSION, BLOB_FORMATS[blob_format], unit.shape[1], float(vector_norm),
+                             float(scale)) + suffix + vector.tobytes()
+            for vector_norm, scale, vector in zip(norms, scales, payload)]
+
+class EmbeddingWriter:
+    """Writes embeddings with execute_async, at most `concurrency` in flight.
+
+    write() blocks once the limit is reached, which in turn stalls the
+    encoder and the reader, so memory stays bounded when Keyspaces is slow.
+    """
+
+    def __init__(self, session, model_id, concurrency, blob_format="float16"):
+        query = ("INSERT INTO document_embeddings (id, source, embedding, content_hash, model_id) "
+                 "VALUES (?, ?, ?, ?, ?)")
+        self.session = session
+        self.prepared = session.prepare(query)
+        self.model_id = model_id
+        self.blob_format = blob_format
+        self.concurrency = concurrency
+        self.slots = threading.BoundedSemaphore(concurrency)
+        self.lock = threading.Lock()
+        self.written = 0
+        self.failed = 0
+        self.first_error = None
+        self.blocked_seconds = 0.0
+
+    def write(self, source, docs, embeddings):
+        blobs = encode_embedding_blobs(embeddings, self.blob_format, self.model_id)
+        for doc, blob in zip(docs, blobs):
+            if not self.slots.acquire(blocking=False):
+                blocked = time.perf_counter()
+                self.slots.acquire()
+                self.blocked_seconds += time.perf_counter() - blocked
+            future = self.session.execute_async(self.prepared, (doc['id'], source, blob, doc['hash'],
+                                                                self.model_id))
+            future.add_callbacks(self._written, self._failed, errback_args=(source, doc['id']))
+
+    def _written(self, _):
+        with self.lock:
+            self.written += 1
+        self.slots.release()
+
+    def _failed(self, error, source, doc_id):
+        with self.lock:
+            self.failed += 1
+            if self.first_error is None:
+                self.first_error = f"{source}/{doc_id}: {error}"
+        self.slots.release()
+
+    def drain(self):
+        started = time.perf_counter()
+        for _ in range(self.concurrency):
+            self.slots.acquire()
+        for _ in range(self.concurrency):
+            self.slots.release()
+        return time.perf_counter() - started
+
+def peak_memory_mib():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def run_embedding_pipeline(session, engine, model_id, stored, fetch_size=1000, batch_size=256,
+                           prefetch_batches=2, write_concurrency=64, blob_format="float16", progress_seconds=30):
+    meters = {name: StageMeter(name) for name in ("fetch", "skip", "fetch_blocked", "encode", "write")}
+    batches = queue.Queue(maxsize=prefetch_batches)
+    reader = threading.Thread(target=read_document_batches, name="document-reader",
+                              args=(session, stored, batch_size, fetch_size, batches, meters), daemon=True)
+    writer = EmbeddingWriter(session, model_id, write_concurrency, blob_format)
+    started = time.perf_counter()
+    last_progress = started
+    reader.start()
+    while True:
+        item = batches.get()
+        if item is None:
+            break
+        if isinstance(item, Exception):
+            raise item
+        source, docs = item
+        encode_started = time.perf_counter()
+        embeddings = compute_embeddings_for_docs(docs, engine)
+        meters["encode"].add(len(docs), time.perf_counter() - encode_started)
+        writer.write(source, docs, embeddings)
+        if time.perf_counter() - last_progress >= progress_seconds:
+            last_progress = time.perf_counter()
+            print(f"Progress: {meters['fetch'].items} read, {meters['skip'].items} skipped, "
+                  f"{meters['encode'].items} encoded, {writer.written} written; "
+                  f"peak memory {peak_memory_mib():.0f} MiB.")
+    drain_seconds = writer.drain()
+    elapsed = time.perf_counter() - started
+    meters["write"].add(writer.written, elapsed)
+
+    report = {
+        "read": meters["fetch"].items,
+        "skipped": meters["skip"].items,
+        "encoded": meters["encode"].items,
+        "written": writer.written,
+        "failed": writer.failed,
+        "elapsed_seconds": round(elapsed, 1),
+        "peak_memory_mib": round(peak_memory_mib(), 1),
+    }
+    for name in ("fetch", "encode", "write"):
+        print(meters[name].summary())
+    print(f"Reader waited {meters['fetch_blocked'].seconds:.1f}s on the encoder; encoder waited "
+          f"{writer.blocked_seconds:.1f}s on writes and {drain_seconds:.1f}s draining them.")
+    if writer.failed:
+        raise RuntimeError(f"{writer.failed} embedding writes failed (first: {writer.first_error})")
+    return report
 
 def main():
     bucket_name = os.environ.get("BUCKET_NAME", "BUCKET_NAME")
@@ -107,6 +474,18 @@ def main():
     service_username = os.environ.get("SERVICE_USERNAME")
     service_password = os.environ.get("SERVICE_PASSWORD")
     cert_path = os.environ.get("CERT_PATH", "/sf-class2-root.crt")
+    embedding_backend = os.environ.get("EMBEDDING_BACKEND", "torch")
+    embedding_threads = int(os.environ.get("EMBEDDING_THREADS", "0"))
+    embedding_model_dir = os.environ.get("EMBEDDING_MODEL_DIR", "/app/models")
+    onnx_quantization = os.environ.get("ONNX_QUANTIZATION", "avx2")
+    full_rebuild = os.environ.get("FULL_REBUILD", "false").lower() in ("1", "true", "yes")
+    fetch_size = int(os.environ.get("FETCH_SIZE", "1000"))
+    batch_size = int(os.environ.get("ENCODE_BATCH_SIZE", "256"))
+    model_batch_size = int(os.environ.get("MODEL_BATCH_SIZE", "32"))
+    encode_workers = int(os.environ.get("ENCODE_WORKERS", "0"))
+    prefetch_batches = int(os.environ.get("PREFETCH_BATCHES", "2"))
+    write_concurrency = int(os.environ.get("WRITE_CONCURRENCY", "64"))
+    embedding_format = os.environ.get("EMBEDDING_FORMAT", "float16")
 
     print("Listing CSV files from S3...")
     csv_keys = list_csv_keys(bucket_name, normalized_prefix, aws_region)
@@ -135,19 +514,31 @@ def main():
     session.set_keyspace("research_data")
     session.default_consistency_level = ConsistencyLevel.LOCAL_QUORUM
 
-    model = SentenceTransformer('all-MiniLM-L6-v2')
-
-    openalex_docs = fetch_openalex_documents(session)
-    semantic_docs = fetch_semantic_documents(session)
-    print(f"Fetched {len(openalex_docs)} OpenAlex documents and {len(semantic_docs)} Semantic Scholar documents.")
+    model_name = 'all-MiniLM-L6-v2'
+    engine = EncodingEngine(model_name, embedding_backend, embedding_threads, embedding_model_dir,
+                            onnx_quantization, workers=encode_workers, batch_size=model_batch_size)
+    # Vectors from different backends differ slightly, so the backend is part of the identity.
+    model_id = f"{model_name}:{embedding_backend}"
+    if embedding_backend == "onnx-int8":
+        model_id += f"-{onnx_quantization}"
 
-    openalex_embeddings = compute_embeddings_for_docs(openalex_docs, model)
-    semantic_embeddings = compute_embeddings_for_docs(semantic_docs, model)
-    print("Computed embeddings for both data sources.")
+    ensure_embedding_columns(session)
+    if full_rebuild:
+        print(f"Full rebuild requested; re-encoding every document with {model_id}.")
+        stored = StoredHashes(array('Q'), array('Q'))
+    else:
+        stored = load_stored_hashes(session, model_id, fetch_size)
+        print(f"Found {len(stored)} stored embeddings for {model_id}.")
 
-    store_embeddings(session, openalex_embeddings, "openalex")
-    store_embeddings(session, semantic_embeddings, "semantic")
-    print("Stored all embeddings successfully.")
+    try:
+        report = run_embedding_pipeline(session, engine, model_id, stored, fetch_size=fetch_size,
+                                        batch_size=batch_size, prefetch_batches=prefetch_batches,
+                                        write_concurrency=write_concurrency, blob_format=embedding_format)
+    finally:
+        engine.close()
+    print(f"Stored {report['written']} embeddings; skipped {report['skipped']} unchanged "
+          f"of {report['read']} documents in {report['elapsed_seconds']}s.")
+    print(json.dumps(report))
 
 if __name__ == "__main__":
     main()
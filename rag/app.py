@@ -1,9 +1,24 @@
 import os
+import sys
+import asyncio
 import ssl
+import json
+import time
+import shutil
+import hashlib
+import struct
+import queue
+import threading
+import unicodedata
+from collections import Counter, OrderedDict, deque, namedtuple
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor
 import numpy as np
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse, Response
 from pydantic import BaseModel
+from typing import List, Optional
 from cassandra.cluster import Cluster
 from cassandra.auth import PlainTextAuthProvider
 from cassandra import ConsistencyLevel
@@ -14,6 +29,8 @@ import boto3
 import pandas as pd
 import io
 import faiss
+from prometheus_client import Histogram, REGISTRY, CONTENT_TYPE_LATEST, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
 
 app = FastAPI()
 
@@ -25,14 +42,526 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-faiss_index = None
-docs_metadata = None
+EMBEDDING_MODEL_NAME = 'all-MiniLM-L6-v2'
+# torch (reference), onnx (exported graph) or onnx-int8 (dynamically quantized).
+EMBEDDING_BACKEND = os.environ.get("EMBEDDING_BACKEND", "torch")
+EMBEDDING_THREADS = int(os.environ.get("EMBEDDING_THREADS", "0"))
+EMBEDDING_MODEL_DIR = os.environ.get("EMBEDDING_MODEL_DIR", "/app/models")
+ONNX_QUANTIZATION = os.environ.get("ONNX_QUANTIZATION", "avx2")
+
+SNAPSHOT_FORMAT_VERSION = 4
+SNAPSHOT_FILES = ("manifest.json", "index.faiss", "id_bytes.npy", "id_offsets.npy", "source_codes.npy", "years.npy",
+                  "groups.npy")
+SNAPSHOT_DIR = os.environ.get("SNAPSHOT_DIR", "/app/snapshot")
+SNAPSHOT_BUCKET = os.environ.get("SNAPSHOT_BUCKET")
+SNAPSHOT_PREFIX = os.environ.get("SNAPSHOT_PREFIX", "rag-snapshot/")
+SNAPSHOT_MAX_AGE_SECONDS = float(os.environ.get("SNAPSHOT_MAX_AGE_SECONDS", "0"))
+EXPECTED_CORPUS_VERSION = os.environ.get("CORPUS_VERSION")
+AWS_REGION = os.environ.get("AWS_REGION", "us-east-2")
+HYDRATION_DEADLINE_SECONDS = float(os.environ.get("HYDRATION_DEADLINE_SECONDS", "1.0"))
+DETAILS_CACHE_MAX_BYTES = int(os.environ.get("DETAILS_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+DETAILS_CACHE_TTL_SECONDS = float(os.environ.get("DETAILS_CACHE_TTL_SECONDS", "3600"))
+DETAILS_CACHE_WARMUP_SIZE = int(os.environ.get("DETAILS_CACHE_WARMUP_SIZE", "0"))
+DETAILS_CACHE_WARMUP_FILE = os.environ.get("DETAILS_CACHE_WARMUP_FILE",
+                                           os.path.join(SNAPSHOT_DIR, "hot_documents.json"))
+QUERY_VECTOR_CACHE_MAX_BYTES = int(os.environ.get("QUERY_VECTOR_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+QUERY_RESULT_CACHE_MAX_BYTES = int(os.environ.get("QUERY_RESULT_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+BATCH_WINDOW_MS = float(os.environ.get("BATCH_WINDOW_MS", "5"))
+BATCH_MAX_SIZE = int(os.environ.get("BATCH_MAX_SIZE", "32"))
+BATCH_QUERY_CHUNK_SIZE = int(os.environ.get("BATCH_QUERY_CHUNK_SIZE", "256"))
+# Filters matching at most this many rows are searched exactly over the
+# subset instead of through the ANN structure with an ID selector.
+FILTER_EXACT_MAX_ROWS = int(os.environ.get("FILTER_EXACT_MAX_ROWS", "4096"))
+FILTER_CACHE_SIZE = int(os.environ.get("FILTER_CACHE_SIZE", "64"))
+CPU_WORKERS = int(os.environ.get("CPU_WORKERS", str(os.cpu_count() or 1)))
+MAX_INFLIGHT_REQUESTS = int(os.environ.get("MAX_INFLIGHT_REQUESTS", "64"))
+RETRY_AFTER_SECONDS = int(os.environ.get("RETRY_AFTER_SECONDS", "1"))
+PROFILE_THRESHOLD_MS = float(os.environ.get("PROFILE_THRESHOLD_MS", "0"))
+PROFILE_INTERVAL_MS = float(os.environ.get("PROFILE_INTERVAL_MS", "5"))
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "/tmp/rag-profiles")
+REFRESH_INTERVAL_SECONDS = float(os.environ.get("REFRESH_INTERVAL_SECONDS", "0"))
+REFRESH_REBUILD_FRACTION = float(os.environ.get("REFRESH_REBUILD_FRACTION", "0.2"))
+SERVE_WORKERS = int(os.environ.get("SERVE_WORKERS", "1"))
+# Set by the loader for the workers it starts: map the loader's snapshot
+# instead of scanning Keyspaces, and follow CURRENT for refreshed versions.
+INDEX_ATTACH_ONLY = os.environ.get("INDEX_ATTACH_ONLY") == "1"
+SNAPSHOT_POLL_SECONDS = float(os.environ.get("SNAPSHOT_POLL_SECONDS", "30"))
+
+INDEX_CONFIG = {
+    "type": os.environ.get("INDEX_TYPE", "flat"),
+    "nlist": int(os.environ.get("IVF_NLIST", "0")),
+    "nprobe": int(os.environ.get("IVF_NPROBE", "16")),
+    "hnsw_m": int(os.environ.get("HNSW_M", "32")),
+    "ef_construction": int(os.environ.get("HNSW_EF_CONSTRUCTION", "200")),
+    "ef_search": int(os.environ.get("HNSW_EF_SEARCH", "64")),
+    "pq_m": int(os.environ.get("PQ_M", "48")),
+    "pq_nbits": int(os.environ.get("PQ_NBITS", "8")),
+    "train_sample": int(os.environ.get("INDEX_TRAIN_SAMPLE", "100000")),
+}
+INDEX_BUILD_KEYS = ("type", "nlist", "hnsw_m", "ef_construction", "pq_m", "pq_nbits")
+# Near-duplicate grouping at build time: rows whose embeddings are at least
+# DEDUP_SIMILARITY apart, or whose normalized titles match and embeddings
+# are at least DEDUP_TITLE_SIMILARITY apart, collapse to one hit per query.
+DEDUP_CONFIG = {
+    "similarity": float(os.environ.get("DEDUP_SIMILARITY", "0.97")),
+    "title_similarity": float(os.environ.get("DEDUP_TITLE_SIMILARITY", "0.85")),
+    "neighbours": int(os.environ.get("DEDUP_NEIGHBOURS", "4")),
+    "nprobe": int(os.environ.get("DEDUP_NPROBE", "2")),
+}
+
+search_state = None
 embedding_model = None
 cassandra_session = None
+lookup_statements = None
+query_batcher = None
+index_refresher = None
+cpu_executor = None
+profiler = None
+startup_state = {
+    "ready": False,
+    "load_path": None,
+    "stale_reason": None,
+    "corpus_version": None,
+    "index_load_seconds": None,
+    "startup_seconds": None,
+}
+refresh_state = {
+    "last_refresh_at": None,
+    "last_refresh_mode": None,
+    "last_refresh_added": 0,
+    "last_refresh_seconds": None,
+    "last_refresh_error": None,
+}
+
+QUERY_STAGE_SECONDS = Histogram(
+    "rag_query_stage_seconds", "Time spent in each stage of the query path.", ["stage"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+)
+REQUEST_SECONDS = Histogram(
+    "rag_request_seconds", "End-to-end request latency.", ["path"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+STARTUP_STAGE_SECONDS = Histogram(
+    "rag_startup_stage_seconds", "Time spent in each startup or rebuild stage.", ["stage"],
+    buckets=(0.01, 0.1, 0.5, 1.0, 5.0, 15.0, 60.0, 300.0, 900.0),
+)
+
+class LRUCache:
+    def __init__(self, max_bytes, ttl_seconds=None, sizeof=None):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.sizeof = sizeof or (lambda key, value: sys.getsizeof(value))
+        self.entries = OrderedDict()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, size, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        size = self.sizeof(key, value)
+        if size > self.max_bytes:
+            return
+        expires_at = time.monotonic() + self.ttl_seconds if self.ttl_seconds else None
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (value, size, expires_at)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted_size, _) = self.entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.current_bytes = 0
+
+    def _remove(self, key):
+        _, size, _ = self.entries.pop(key)
+        self.current_bytes -= size
+
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+class ReadWriteLock:
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.readers = 0
+        self.writer = False
+        self.writers_waiting = 0
+
+    @contextmanager
+    def reading(self):
+        with self.condition:
+            while self.writer or self.writers_waiting:
+                self.condition.wait()
+            self.readers += 1
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.readers -= 1
+                if not self.readers:
+                    self.condition.notify_all()
+
+    @contextmanager
+    def writing(self):
+        with self.condition:
+            self.writers_waiting += 1
+            while self.writer or self.readers:
+                self.condition.wait()
+            self.writers_waiting -= 1
+            self.writer = True
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.writer = False
+                self.condition.notify_all()
+
+class DocumentTable:
+    def __init__(self, id_bytes, id_offsets, source_codes, source_names, years=None, groups=None):
+        self.id_bytes = id_bytes
+        self.id_offsets = id_offsets
+        self.source_codes = source_codes
+        self.source_names = list(source_names)
+        # Publication year per row, 0 when unknown.
+        self.years = years if years is not None else np.zeros(len(source_codes), dtype=np.int16)
+        # Near-duplicate group per row: the lowest row number in the group.
+        self.groups = groups if groups is not None else np.arange(len(source_codes), dtype=np.int32)
+        self.duplicates = None
+
+    @classmethod
+    def from_rows(cls, ids, sources, source_names=None, years=None):
+        encoded = [doc_id.encode('utf-8') for doc_id in ids]
+        id_offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum(np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded)), out=id_offsets[1:])
+        id_bytes = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        source_names = list(source_names) if source_names is not None else []
+        codes = {source: code for code, source in enumerate(source_names)}
+        for source in sources:
+            if source not in codes:
+                codes[source] = len(source_names)
+                source_names.append(source)
+        source_codes = np.fromiter((codes[source] for source in sources), dtype=np.uint8, count=len(sources))
+        if years is not None:
+            years = np.fromiter((year or 0 for year in years), dtype=np.int16, count=len(sources))
+        return cls(id_bytes, id_offsets, source_codes, source_names, years)
+
+    def __len__(self):
+        return len(self.source_codes)
+
+    def id_at(self, row):
+        return self.id_bytes[self.id_offsets[row]:self.id_offsets[row + 1]].tobytes().decode('utf-8')
+
+    def source_at(self, row):
+        return self.source_names[self.source_codes[row]]
+
+    def doc_at(self, row):
+        return {'id': self.id_at(row), 'source': self.source_at(row)}
+
+    def keys(self):
+        for row in range(len(self)):
+            yield self.source_at(row), self.id_at(row)
+
+    def append_rows(self, keys, years=None):
+        # Appended rows start in their own group; the next rebuild regroups them.
+        extra = DocumentTable.from_rows([doc_id for _, doc_id in keys], [source for source, _ in keys],
+                                        self.source_names, years)
+        return DocumentTable(
+            np.concatenate([self.id_bytes, extra.id_bytes]),
+            np.concatenate([self.id_offsets, extra.id_offsets[1:] + self.id_offsets[-1]]),
+            np.concatenate([self.source_codes, extra.source_codes]),
+            extra.source_names,
+            np.concatenate([self.years, extra.years]),
+            np.concatenate([self.groups, extra.groups + len(self)]),
+        )
+
+    def duplicate_count(self):
+        if self.duplicates is None:
+            self.duplicates = int(np.count_nonzero(self.groups != np.arange(len(self), dtype=self.groups.dtype)))
+        return self.duplicates
+
+    def collapse(self, rows, k):
+        """Keep the best-ranked row of each duplicate group, up to k rows."""
+        seen = set()
+        kept = []
+        for row in rows:
+            if row < 0:
+                break
+            group = self.groups[row]
+            if group in seen:
+                continue
+            seen.add(group)
+            kept.append(row)
+            if len(kept) == k:
+                break
+        return kept
+
+    def filter_mask(self, search_filter):
+        mask = np.ones(len(self), dtype=bool)
+        if search_filter.source is not None:
+            if search_filter.source not in self.source_names:
+                return np.zeros(len(self), dtype=bool)
+            mask &= self.source_codes == self.source_names.index(search_filter.source)
+        if search_filter.year_from is not None or search_filter.year_to is not None:
+            mask &= self.years != 0
+        if search_filter.year_from is not None:
+            mask &= self.years >= search_filter.year_from
+        if search_filter.year_to is not None:
+            mask &= self.years <= search_filter.year_to
+        return mask
+
+    @property
+    def nbytes(self):
+        return (self.id_bytes.nbytes + self.id_offsets.nbytes + self.source_codes.nbytes + self.years.nbytes
+                + self.groups.nbytes)
+
+SearchFilter = namedtuple("SearchFilter", ["source", "year_from", "year_to"])
+NO_FILTER = SearchFilter(None, None, None)
+
+class FilterSelection:
+    """Rows matching one filter, as a packed bitmap for faiss ID selectors
+    and, for small subsets, as explicit row ids."""
+
+    def __init__(self, mask):
+        self.count = int(mask.sum())
+        self.fraction = self.count / len(mask) if len(mask) else 0.0
+        self.bitmap = np.packbits(mask, bitorder="little")
+        self.rows = np.flatnonzero(mask) if self.count <= FILTER_EXACT_MAX_ROWS else None
+
+    def selector(self, total):
+        # The selector points into self.bitmap; keep the selection alive while searching.
+        return faiss.IDSelectorBitmap(total, faiss.swig_ptr(self.bitmap))
+
+class SearchState:
+    def __init__(self, index, docs, version, mutable, refreshed_through=None, snapshot_path=None):
+        self.index = index
+        self.docs = docs
+        self.version = version
+        self.mutable = mutable
+        self.refreshed_through = refreshed_through
+        # Directory the index is mapped from, when it is not mutable.
+        self.snapshot_path = snapshot_path
+        self.lock = ReadWriteLock()
+        self.positions = None
+        self.selections = OrderedDict()
+        self.selections_lock = threading.Lock()
+
+    def selection(self, search_filter):
+        with self.selections_lock:
+            selection = self.selections.get(search_filter)
+            if selection is not None:
+                self.selections.move_to_end(search_filter)
+                return selection
+        selection = FilterSelection(self.docs.filter_mask(search_filter))
+        with self.selections_lock:
+            self.selections[search_filter] = selection
+            while len(self.selections) > FILTER_CACHE_SIZE:
+                self.selections.popitem(last=False)
+        return selection
+
+    def row_positions(self):
+        if self.positions is None:
+            self.positions = {key: row for row, key in enumerate(self.docs.keys())}
+        return self.positions
+
+class AdmissionController:
+    def __init__(self, max_inflight):
+        self.max_inflight = max_inflight
+        self.inflight = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.lock = threading.Lock()
+
+    def try_acquire(self):
+        with self.lock:
+            if self.inflight >= self.max_inflight:
+                self.rejected += 1
+                return False
+            self.inflight += 1
+            self.admitted += 1
+            return True
+
+    def release(self):
+        with self.lock:
+            self.inflight -= 1
+
+    @contextmanager
+    def slot(self):
+        if not self.try_acquire():
+            raise HTTPException(status_code=503, detail="Service overloaded, retry later.",
+                                headers={"Retry-After": str(RETRY_AFTER_SECONDS)})
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "max_inflight": self.max_inflight,
+                "inflight": self.inflight,
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+            }
+
+class SamplingProfiler:
+    def __init__(self, interval_seconds, threshold_seconds, output_dir, max_samples=200000):
+        self.interval_seconds = interval_seconds
+        self.threshold_seconds = threshold_seconds
+        self.output_dir = output_dir
+        self.samples = deque(maxlen=max_samples)
+        self.active = 0
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def start(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while True:
+            time.sleep(self.interval_seconds)
+            if not self.active:
+                continue
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            now = time.monotonic()
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id != own_id:
+                    self.samples.append((now, collapse_stack(names.get(thread_id, str(thread_id)), frame)))
+
+    def begin(self):
+        with self.lock:
+            self.active += 1
+        return time.monotonic()
+
+    def end(self, started, label):
+        with self.lock:
+            self.active -= 1
+        elapsed = time.monotonic() - started
+        if elapsed < self.threshold_seconds:
+            return
+        stacks = Counter(stack for sampled_at, stack in list(self.samples) if sampled_at >= started)
+        if not stacks:
+            return
+        path = os.path.join(self.output_dir, f"{int(time.time() * 1000)}-{label}-{int(elapsed * 1000)}ms.folded")
+        with open(path, "w") as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        print(f"Slow request ({elapsed * 1000:.0f} ms); wrote {sum(stacks.values())} stack samples to {path}")
+
+def collapse_stack(thread_name, frame):
+    frames = []
+    while frame is not None:
+        code = frame.f_code
+        frames.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+        frame = frame.f_back
+    frames.append(thread_name)
+    return ";".join(reversed(frames))
+
+def details_size(key, details):
+    size = sys.getsizeof(details) + sum(sys.getsizeof(part) for part in key)
+    for field, value in details.items():
+        size += sys.getsizeof(field) + sys.getsizeof(value)
+    return size
+
+def query_vector_size(key, vector):
+    return sys.getsizeof(key) + vector.nbytes
+
+def query_result_size(key, results):
+    size = sys.getsizeof(key[0]) + sys.getsizeof(results)
+    for doc in results:
+        size += sys.getsizeof(doc) + sys.getsizeof(doc['id']) + sys.getsizeof(doc['source'])
+    return size
+
+details_cache = LRUCache(DETAILS_CACHE_MAX_BYTES, DETAILS_CACHE_TTL_SECONDS, details_size)
+query_vector_cache = LRUCache(QUERY_VECTOR_CACHE_MAX_BYTES, sizeof=query_vector_size)
+query_result_cache = LRUCache(QUERY_RESULT_CACHE_MAX_BYTES, sizeof=query_result_size)
+admission = AdmissionController(MAX_INFLIGHT_REQUESTS)
+document_hits = Counter()
+document_hits_lock = threading.Lock()
 
 class QueryRequest(BaseModel):
     query: str
     k: int = 5
+    source: Optional[str] = None
+    year_from: Optional[int] = None
+    year_to: Optional[int] = None
+
+class BatchQueryRequest(BaseModel):
+    queries: List[QueryRequest]
+
+# onnx_model_path and load_sentence_encoder are copied in
+# embeddings/embedding.py, which encodes the documents; keep the two
+# identical so query and document vectors come from the same model.
+def onnx_model_path(model_name, backend, model_dir, quantization="avx2"):
+    """Export the model to ONNX (and quantize it for onnx-int8) once, returning
+    the local directory and the graph file to load from it."""
+    path = os.path.join(model_dir, model_name.replace("/", "__") + "-onnx")
+    file_name = "onnx/model.onnx" if backend == "onnx" else f"onnx/model_qint8_{quantization}.onnx"
+    if os.path.exists(os.path.join(path, file_name)):
+        return path, file_name
+    if not os.path.exists(os.path.join(path, "onnx", "model.onnx")):
+        SentenceTransformer(model_name, backend="onnx").save_pretrained(path)
+    if backend == "onnx-int8":
+        from sentence_transformers import export_dynamic_quantized_onnx_model
+        export_dynamic_quantized_onnx_model(SentenceTransformer(path, backend="onnx"), quantization, path)
+    return path, file_name
+
+def load_sentence_encoder(model_name, backend="torch", threads=0, model_dir="/app/models", quantization="avx2"):
+    if backend == "torch":
+        if threads:
+            import torch
+            torch.set_num_threads(threads)
+        return SentenceTransformer(model_name)
+    if backend not in ("onnx", "onnx-int8"):
+        raise ValueError(f"Unknown embedding backend {backend!r}")
+    import onnxruntime
+    path, file_name = onnx_model_path(model_name, backend, model_dir, quantization)
+    session_options = onnxruntime.SessionOptions()
+    if threads:
+        session_options.intra_op_num_threads = threads
+        session_options.inter_op_num_threads = 1
+    return SentenceTransformer(path, backend="onnx", model_kwargs={
+        "file_name": file_name,
+        "provider": "CPUExecutionProvider",
+        "session_options": session_options,
+    })
+
+def load_embedding_model():
+    return load_sentence_encoder(EMBEDDING_MODEL_NAME, EMBEDDING_BACKEND, EMBEDDING_THREADS, EMBEDDING_MODEL_DIR,
+                                 ONNX_QUANTIZATION)
 
 def setup_cassandra_session():
     keyspaces_endpoint = os.environ.get("KEYSPACES_ENDPOINT", "cassandra.us-east-2.amazonaws.com")
@@ -63,102 +592,1232 @@ def setup_cassandra_session():
     session.default_consistency_level = ConsistencyLevel.LOCAL_QUORUM
     return session
 
-def fetch_all_document_embeddings(session):
+ATTRIBUTE_QUERIES = {
+    "openalex": "SELECT id AS doc_id, publication_year AS year, title FROM openalex",
+    "semantic": "SELECT paperid AS doc_id, year, title FROM semantic_scholar",
+}
+YEAR_LOOKUP_QUERIES = {
+    "openalex": "SELECT publication_year AS year FROM openalex WHERE id = ?",
+    "semantic": "SELECT year FROM semantic_scholar WHERE paperid = ?",
+}
+
+def title_key(title):
+    """64-bit key of a title with case, accents, punctuation and spacing folded."""
+    if not title:
+        return 0
+    folded = unicodedata.normalize("NFKD", title).casefold()
+    words = "".join(c if c.isalnum() else " " for c in folded if not unicodedata.combining(c)).split()
+    if not words:
+        return 0
+    return int.from_bytes(hashlib.blake2b(" ".join(words).encode('utf-8'), digest_size=8).digest(), "little",
+                          signed=True) or 1
+
+def fetch_document_attributes(session):
+    """(source, id) -> (publication year, title key) for filtering and dedup."""
+    attributes = {}
+    for source, query in ATTRIBUTE_QUERIES.items():
+        try:
+            for row in session.execute(query):
+                attributes[(source, row.doc_id)] = (row.year, title_key(row.title))
+        except Exception as e:
+            print(f"Could not fetch document attributes for {source}: {e}")
+    return attributes
+
+def fetch_years_by_key(session, keys, chunk_size=256):
+    statements = {source: session.prepare(query) for source, query in YEAR_LOOKUP_QUERIES.items()}
+    years = []
+    for start in range(0, len(keys), chunk_size):
+        chunk = keys[start:start + chunk_size]
+        futures = [session.execute_async(statements[source], (doc_id,)) if source in statements else None
+                   for source, doc_id in chunk]
+        for future in futures:
+            row = future.result().one() if future is not None else None
+            years.append(row.year if row else None)
+    return years
+
+# Embedding blobs carry a header (magic, version, dtype, dimension, the
+# vector's norm before normalization, int8 scale) and the model id, then the
+# unit-length vector as float32, float16 or int8. Rows written before the
+# header existed are bare float32 arrays; the magic reads as a float32 NaN,
+# which no embedding starts with, so the two cannot be confused. The writer
+# in embeddings/embedding.py must stay in step with this.
+BLOB_MAGIC = b"EB\xc0\x7f"
+BLOB_VERSION = 1
+BLOB_HEADER = struct.Struct("<4sBBHff")
+BLOB_DTYPES = {0: np.float32, 1: np.float16, 2: np.int8}
+BLOB_FORMATS = {"float32": 0, "float16": 1, "int8": 2}
+
+def decode_embedding_blob(blob):
+    """Returns the stored vector as float32, whatever format it was written in."""
+    if blob[:4] != BLOB_MAGIC:
+        return np.frombuffer(blob, dtype=np.float32)
+    _, version, dtype, dimension, _, scale = BLOB_HEADER.unpack_from(blob)
+    if version != BLOB_VERSION or dtype not in BLOB_DTYPES:
+        raise ValueError(f"Unsupported embedding blob (version {version}, dtype {dtype})")
+    offset = BLOB_HEADER.size + 1 + blob[BLOB_HEADER.size]
+    vector = np.frombuffer(blob, dtype=BLOB_DTYPES[dtype], count=dimension, offset=offset)
+    if dtype == BLOB_FORMATS["int8"]:
+        return vector.astype(np.float32) * np.float32(scale)
+    return vector.astype(np.float32)
+
+def fetch_all_document_embeddings(session, attributes=None):
     query = "SELECT id, source, embedding FROM document_embeddings"
     rows = session.execute(query)
-    docs = []
+    attributes = attributes or {}
+    ids = []
+    sources = []
+    row_years = []
+    title_keys = []
+    embeddings = None
+    count = 0
     for row in rows:
-        emb = np.frombuffer(row.embedding, dtype=np.float32)
-        docs.append({
-            'id': row.id,
-            'source': row.source,
-            'embedding': emb
-        })
-    return docs
-
-def build_faiss_index(docs):
-    if not docs:
+        emb = decode_embedding_blob(row.embedding)
+        if embeddings is None:
+            embeddings = np.empty((1024, emb.shape[0]), dtype=np.float32)
+        elif count == len(embeddings):
+            grown = np.empty((2 * count, embeddings.shape[1]), dtype=np.float32)
+            grown[:count] = embeddings
+            embeddings = grown
+        embeddings[count] = emb
+        ids.append(row.id)
+        sources.append(row.source)
+        year, key = attributes.get((row.source, row.id), (None, 0))
+        row_years.append(year)
+        title_keys.append(key)
+        count += 1
+    if embeddings is None:
+        return DocumentTable.from_rows([], []), np.empty((0, 0), dtype=np.float32), np.empty(0, dtype=np.int64)
+    return (DocumentTable.from_rows(ids, sources, years=row_years), embeddings[:count],
+            np.array(title_keys, dtype=np.int64))
+
+class ServiceCollector:
+    def collect(self):
+        state = search_state
+        yield GaugeMetricFamily("rag_index_vectors", "Vectors in the live FAISS index.",
+                                value=state.index.ntotal if state is not None else 0)
+        yield GaugeMetricFamily("rag_documents", "Rows in the live document table.",
+                                value=len(state.docs) if state is not None else 0)
+        caches = {
+            "details": details_cache.stats(),
+            "query_vector": query_vector_cache.stats(),
+            "query_result": query_result_cache.stats(),
+        }
+        entries = GaugeMetricFamily("rag_cache_entries", "Entries held by each cache.", labels=["cache"])
+        occupancy = GaugeMetricFamily("rag_cache_bytes", "Estimated bytes held by each cache.", labels=["cache"])
+        hits = CounterMetricFamily("rag_cache_hits", "Cache hits.", labels=["cache"])
+        misses = CounterMetricFamily("rag_cache_misses", "Cache misses.", labels=["cache"])
+        evictions = CounterMetricFamily("rag_cache_evictions", "Cache evictions.", labels=["cache"])
+        for name, stats in caches.items():
+            entries.add_metric([name], stats["entries"])
+            occupancy.add_metric([name], stats["bytes"])
+            hits.add_metric([name], stats["hits"])
+            misses.add_metric([name], stats["misses"])
+            evictions.add_metric([name], stats["evictions"])
+        yield from (entries, occupancy, hits, misses, evictions)
+        admission_stats = admission.stats()
+        yield GaugeMetricFamily("rag_inflight_requests", "Requests currently admitted.",
+                                value=admission_stats["inflight"])
+        yield CounterMetricFamily("rag_rejected_requests", "Requests rejected by admission control.",
+                                  value=admission_stats["rejected"])
+
+REGISTRY.register(ServiceCollector())
+
+def index_build_spec(config):
+    return {key: config[key] for key in INDEX_BUILD_KEYS}
+
+def ivf_nlist(config, count):
+    if config["nlist"]:
+        return config["nlist"]
+    return max(1, min(int(4 * np.sqrt(count)), count // 39))
+
+def index_factory_string(config, count):
+    index_type = config["type"]
+    if index_type == "flat":
+        return "Flat"
+    if index_type == "ivf":
+        return f"IVF{ivf_nlist(config, count)},Flat"
+    if index_type == "hnsw":
+        return f"HNSW{config['hnsw_m']}"
+    if index_type == "ivfpq":
+        return f"IVF{ivf_nlist(config, count)},PQ{config['pq_m']}x{config['pq_nbits']}"
+    raise ValueError(f"Unknown INDEX_TYPE: {index_type}")
+
+def min_training_points(config, count):
+    if config["type"] == "ivf":
+        return ivf_nlist(config, count)
+    if config["type"] == "ivfpq":
+        return max(ivf_nlist(config, count), 2 ** config["pq_nbits"])
+    return 0
+
+def index_kind(index):
+    # What was actually built, which is flat when there were too few
+    # vectors to train the configured type.
+    if isinstance(index, faiss.IndexIVF):
+        return "ivf"
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, faiss.IndexFlat):
+        return "flat"
+    return "other"
+
+def apply_search_params(index, config):
+    params = faiss.ParameterSpace()
+    if isinstance(index, faiss.IndexIVF):
+        params.set_index_parameter(index, "nprobe", config["nprobe"])
+    elif isinstance(index, faiss.IndexHNSW):
+        params.set_index_parameter(index, "efSearch", config["ef_search"])
+
+def build_index_from_vectors(embeddings, config):
+    count, dimension = embeddings.shape
+    if count < min_training_points(config, count):
+        print(f"Only {count} vectors; too few to train a {config['type']} index, using flat.")
+        config = dict(config, type="flat")
+    if config["type"] == "ivfpq" and dimension % config["pq_m"]:
+        raise ValueError(f"PQ_M={config['pq_m']} must divide the embedding dimension {dimension}.")
+    index = faiss.index_factory(dimension, index_factory_string(config, count), faiss.METRIC_INNER_PRODUCT)
+    if config["type"] == "hnsw":
+        index.hnsw.efConstruction = config["ef_construction"]
+    if not index.is_trained:
+        if count > config["train_sample"]:
+            sample = np.random.default_rng(0).choice(count, config["train_sample"], replace=False)
+            index.train(embeddings[np.sort(sample)])
+        else:
+            index.train(embeddings)
+    index.add(embeddings)
+    apply_search_params(index, config)
+    return index
+
+def build_faiss_index(embeddings, config=None):
+    if not len(embeddings):
         raise ValueError("No documents available for indexing.")
-    dimension = docs[0]['embedding'].shape[0]
-    embeddings = []
-    for doc in docs:
-        norm_emb = doc['embedding'] / (norm(doc['embedding']) + 1e-10)
-        embeddings.append(norm_emb)
-    embeddings = np.stack(embeddings).astype('float32')
-    index = faiss.IndexFlatIP(dimension)
+    with STARTUP_STAGE_SECONDS.labels("normalize").time():
+        faiss.normalize_L2(embeddings)
+    with STARTUP_STAGE_SECONDS.labels("build").time():
+        return build_index_from_vectors(embeddings, config or INDEX_CONFIG)
+
+def duplicate_candidate_index(embeddings, nprobe):
+    count, dimension = embeddings.shape
+    if count <= 20000:
+        index = faiss.IndexFlatIP(dimension)
+    else:
+        # Near-identical vectors land in the same or a neighbouring cell, so
+        # a coarse IVF probed at a couple of cells finds them cheaply.
+        nlist = int(4 * np.sqrt(count))
+        index = faiss.index_factory(dimension, f"IVF{nlist},Flat", faiss.METRIC_INNER_PRODUCT)
+        sample = np.random.default_rng(0).choice(count, min(count, 40 * nlist), replace=False)
+        index.train(embeddings[np.sort(sample)])
+        index.nprobe = nprobe
     index.add(embeddings)
     return index
 
-def lookup_document_details(session, doc_id, source):
-    if source.lower() == "openalex":
-        query = "SELECT id, title, abstract FROM openalex WHERE id = %s"
-    elif source.lower() == "semantic":
-        query = "SELECT paperid, title, abstract, authors FROM semantic_scholar WHERE paperid = %s"
+def find_duplicate_groups(embeddings, title_keys, config, batch_size=65536):
+    """Union near-duplicate rows into groups labelled by their lowest row.
+
+    embeddings must be L2-normalized. Candidate pairs come from each row's
+    nearest neighbours and from rows sharing a normalized title.
+    """
+    count = len(embeddings)
+    pairs = []
+    index = duplicate_candidate_index(embeddings, config["nprobe"])
+    for start in range(0, count, batch_size):
+        scores, neighbours = index.search(embeddings[start:start + batch_size], config["neighbours"] + 1)
+        rows = np.arange(start, start + len(scores))[:, None]
+        # neighbours > rows keeps each pair once and drops self matches and -1 padding.
+        hits = (scores >= config["similarity"]) & (neighbours > rows)
+        a, b = np.nonzero(hits)
+        pairs.append(np.stack([rows[a, 0], neighbours[a, b]], axis=1))
+    del index
+
+    order = np.argsort(title_keys, kind="stable")
+    sorted_keys = title_keys[order]
+    same_title = (sorted_keys[1:] == sorted_keys[:-1]) & (sorted_keys[1:] != 0)
+    first, second = order[:-1][same_title], order[1:][same_title]
+    similar = np.einsum("ij,ij->i", embeddings[first], embeddings[second]) >= config["title_similarity"]
+    pairs.append(np.stack([first[similar], second[similar]], axis=1))
+
+    parent = np.arange(count, dtype=np.int32)
+    def find(row):
+        while parent[row] != row:
+            parent[row] = parent[parent[row]]
+            row = parent[row]
+        return row
+    for a, b in np.concatenate(pairs):
+        root_a, root_b = find(a), find(b)
+        if root_a != root_b:
+            parent[max(root_a, root_b)] = min(root_a, root_b)
+    # Point every row straight at its root.
+    while True:
+        flattened = parent[parent]
+        if np.array_equal(flattened, parent):
+            return parent
+        parent = flattened
+
+def compute_corpus_version(table, embeddings):
+    digest = hashlib.sha1()
+    digest.update(json.dumps(table.source_names).encode('utf-8'))
+    digest.update(table.source_codes)
+    digest.update(table.id_offsets)
+    digest.update(table.id_bytes)
+    digest.update(table.years)
+    digest.update(np.ascontiguousarray(embeddings))
+    return digest.hexdigest()[:16]
+
+def build_search_index(session):
+    with STARTUP_STAGE_SECONDS.labels("fetch").time():
+        attributes = fetch_document_attributes(session)
+        table, embeddings, title_keys = fetch_all_document_embeddings(session, attributes)
+        del attributes
+    print(f"Fetched {len(table)} documents from Keyspaces ({int(np.count_nonzero(table.years))} with a year).")
+    index = build_faiss_index(embeddings)
+    if DEDUP_CONFIG["similarity"] > 0:
+        with STARTUP_STAGE_SECONDS.labels("dedup").time():
+            table.groups = find_duplicate_groups(embeddings, title_keys, DEDUP_CONFIG)
+        print(f"Grouped {table.duplicate_count()} near-duplicate documents.")
+    corpus_version = compute_corpus_version(table, embeddings)
+    # The index holds its own copy of the vectors; the fetch buffer goes away here.
+    del embeddings
+    return index, table, corpus_version
+
+def index_memory_bytes(index):
+    try:
+        return int(index.ntotal) * int(index.sa_code_size())
+    except RuntimeError:
+        return None
+
+def resident_memory_bytes():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+def memory_report(state):
+    return {
+        "document_table_bytes": int(state.docs.nbytes),
+        "index_bytes": index_memory_bytes(state.index),
+        "resident_bytes": resident_memory_bytes(),
+    }
+
+def read_snapshot_manifest(snapshot_dir):
+    current_path = os.path.join(snapshot_dir, "CURRENT")
+    if not os.path.exists(current_path):
+        return None
+    with open(current_path) as f:
+        name = f.read().strip()
+    manifest_path = os.path.join(snapshot_dir, name, "manifest.json")
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    manifest['path'] = os.path.join(snapshot_dir, name)
+    return manifest
+
+def snapshot_stale_reason(manifest):
+    if manifest is None:
+        return "missing"
+    if manifest.get("format_version") != SNAPSHOT_FORMAT_VERSION:
+        return f"format version {manifest.get('format_version')} != {SNAPSHOT_FORMAT_VERSION}"
+    if manifest.get("model") != EMBEDDING_MODEL_NAME:
+        return f"built for model {manifest.get('model')}"
+    if manifest.get("index") != index_build_spec(INDEX_CONFIG):
+        return f"built with index settings {manifest.get('index')}"
+    if manifest.get("dedup") != DEDUP_CONFIG:
+        return f"built with dedup settings {manifest.get('dedup')}"
+    if EXPECTED_CORPUS_VERSION and manifest.get("corpus_version") != EXPECTED_CORPUS_VERSION:
+        return f"corpus version {manifest.get('corpus_version')} != {EXPECTED_CORPUS_VERSION}"
+    if SNAPSHOT_MAX_AGE_SECONDS and time.time() - manifest.get("created_at", 0) > SNAPSHOT_MAX_AGE_SECONDS:
+        return "older than SNAPSHOT_MAX_AGE_SECONDS"
+    return None
+
+def write_index_snapshot(snapshot_dir, index, table, corpus_version, refreshed_through=None):
+    name = f"{corpus_version}-{int(time.time())}"
+    final_path = os.path.join(snapshot_dir, name)
+    tmp_path = final_path + ".tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    faiss.write_index(index, os.path.join(tmp_path, "index.faiss"))
+    np.save(os.path.join(tmp_path, "id_bytes.npy"), table.id_bytes)
+    np.save(os.path.join(tmp_path, "id_offsets.npy"), table.id_offsets)
+    np.save(os.path.join(tmp_path, "source_codes.npy"), table.source_codes)
+    np.save(os.path.join(tmp_path, "years.npy"), table.years)
+    np.save(os.path.join(tmp_path, "groups.npy"), table.groups)
+    manifest = {
+        "format_version": SNAPSHOT_FORMAT_VERSION,
+        "corpus_version": corpus_version,
+        "model": EMBEDDING_MODEL_NAME,
+        "index": index_build_spec(INDEX_CONFIG),
+        "index_kind": index_kind(index),
+        "dedup": DEDUP_CONFIG,
+        "duplicates": table.duplicate_count(),
+        "dimension": index.d,
+        "count": index.ntotal,
+        "sources": table.source_names,
+        "refreshed_through": refreshed_through,
+        "created_at": time.time(),
+    }
+    with open(os.path.join(tmp_path, "manifest.json"), "w") as f:
+        json.dump(manifest, f)
+    os.rename(tmp_path, final_path)
+
+    # Flip the CURRENT pointer last so readers never see a partial snapshot.
+    current_tmp = os.path.join(snapshot_dir, "CURRENT.tmp")
+    with open(current_tmp, "w") as f:
+        f.write(name)
+    os.replace(current_tmp, os.path.join(snapshot_dir, "CURRENT"))
+
+    for entry in os.listdir(snapshot_dir):
+        entry_path = os.path.join(snapshot_dir, entry)
+        if entry != name and os.path.isdir(entry_path):
+            shutil.rmtree(entry_path, ignore_errors=True)
+
+    manifest['path'] = final_path
+    return manifest
+
+def snapshot_read_flags(kind):
+    # IO_FLAG_MMAP maps IVF inverted lists in place but copies flat code
+    # arrays into anonymous memory; IO_FLAG_MMAP_IFC maps those in place.
+    # File-backed pages are shared by every process mapping the snapshot.
+    # `kind` is the manifest's index_kind; older snapshots lack it.
+    if kind in ("flat", "hnsw") and hasattr(faiss, "IO_FLAG_MMAP_IFC"):
+        return faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY
+    return faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+
+def load_index_snapshot(manifest):
+    path = manifest['path']
+    index = faiss.read_index(os.path.join(path, "index.faiss"), snapshot_read_flags(manifest.get("index_kind")))
+    apply_search_params(index, INDEX_CONFIG)
+    table = DocumentTable(
+        np.load(os.path.join(path, "id_bytes.npy"), mmap_mode="r"),
+        np.load(os.path.join(path, "id_offsets.npy"), mmap_mode="r"),
+        np.load(os.path.join(path, "source_codes.npy"), mmap_mode="r"),
+        manifest['sources'],
+        np.load(os.path.join(path, "years.npy"), mmap_mode="r"),
+        np.load(os.path.join(path, "groups.npy"), mmap_mode="r"),
+    )
+    table.duplicates = manifest.get("duplicates")
+    if index.ntotal != len(table) or len(table.id_offsets) != len(table) + 1:
+        raise ValueError(f"snapshot row count mismatch: index={index.ntotal}, table={len(table)}")
+    return index, table
+
+def download_snapshot_from_s3(bucket_name, prefix, snapshot_dir):
+    s3 = boto3.client('s3', region_name=AWS_REGION)
+    obj = s3.get_object(Bucket=bucket_name, Key=prefix + "CURRENT")
+    name = obj['Body'].read().decode('utf-8').strip()
+    local = read_snapshot_manifest(snapshot_dir)
+    if local is not None and os.path.basename(local['path']) == name:
+        return
+    tmp_path = os.path.join(snapshot_dir, name + ".tmp")
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    for filename in SNAPSHOT_FILES:
+        s3.download_file(bucket_name, f"{prefix}{name}/{filename}", os.path.join(tmp_path, filename))
+    os.rename(tmp_path, os.path.join(snapshot_dir, name))
+    current_tmp = os.path.join(snapshot_dir, "CURRENT.tmp")
+    with open(current_tmp, "w") as f:
+        f.write(name)
+    os.replace(current_tmp, os.path.join(snapshot_dir, "CURRENT"))
+    print(f"Downloaded index snapshot {name} from s3://{bucket_name}/{prefix}")
+
+def upload_snapshot_to_s3(bucket_name, prefix, manifest):
+    s3 = boto3.client('s3', region_name=AWS_REGION)
+    name = os.path.basename(manifest['path'])
+    for filename in SNAPSHOT_FILES:
+        s3.upload_file(os.path.join(manifest['path'], filename), bucket_name, f"{prefix}{name}/{filename}")
+    s3.put_object(Bucket=bucket_name, Key=prefix + "CURRENT", Body=name.encode('utf-8'))
+    print(f"Uploaded index snapshot {name} to s3://{bucket_name}/{prefix}")
+
+def load_or_build_index(session):
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    if SNAPSHOT_BUCKET:
+        try:
+            download_snapshot_from_s3(SNAPSHOT_BUCKET, SNAPSHOT_PREFIX, SNAPSHOT_DIR)
+        except Exception as e:
+            print(f"Could not fetch index snapshot from S3: {e}")
+
+    manifest = read_snapshot_manifest(SNAPSHOT_DIR)
+    stale_reason = snapshot_stale_reason(manifest)
+    if stale_reason is None:
+        try:
+            with STARTUP_STAGE_SECONDS.labels("snapshot_load").time():
+                index, table = load_index_snapshot(manifest)
+            print(f"Mapped index snapshot {manifest['corpus_version']} with {len(table)} documents.")
+            return index, table, manifest, "snapshot", None
+        except Exception as e:
+            stale_reason = f"unreadable ({e})"
+
+    print(f"Rebuilding FAISS index from Keyspaces: snapshot {stale_reason}.")
+    scan_started = int(time.time() * 1e6)
+    index, table, corpus_version = build_search_index(session)
+    manifest = persist_index_snapshot(index, table, corpus_version, scan_started)
+    return index, table, manifest, "rebuild", stale_reason
+
+def attach_index_snapshot():
+    manifest = read_snapshot_manifest(SNAPSHOT_DIR)
+    if manifest is None:
+        raise RuntimeError(f"No index snapshot to attach to in {SNAPSHOT_DIR}")
+    with STARTUP_STAGE_SECONDS.labels("snapshot_load").time():
+        index, table = load_index_snapshot(manifest)
+    return index, table, manifest
+
+def persist_index_snapshot(index, table, corpus_version, refreshed_through):
+    try:
+        with STARTUP_STAGE_SECONDS.labels("snapshot_write").time():
+            manifest = write_index_snapshot(SNAPSHOT_DIR, index, table, corpus_version, refreshed_through)
+        if SNAPSHOT_BUCKET:
+            upload_snapshot_to_s3(SNAPSHOT_BUCKET, SNAPSHOT_PREFIX, manifest)
+        return manifest
+    except Exception as e:
+        print(f"Could not persist index snapshot: {e}")
+        return {"corpus_version": corpus_version, "refreshed_through": refreshed_through}
+
+LOOKUP_QUERIES = {
+    "openalex": "SELECT id, title, abstract FROM openalex WHERE id = ?",
+    "semantic": "SELECT paperid, title, abstract, authors FROM semantic_scholar WHERE paperid = ?",
+}
+
+def prepare_lookup_statements(session):
+    return {source: session.prepare(query) for source, query in LOOKUP_QUERIES.items()}
+
+def row_to_details(source, row):
+    if source == "openalex":
+        details = {
+            "id": row.id,
+            "title": row.title,
+            "abstract": row.abstract
+        }
     else:
-        return {}
+        details = {
+            "paperid": row.paperid,
+            "title": row.title,
+            "abstract": row.abstract,
+            "authors": row.authors
+        }
+    return { k: v for k, v in details.items() if v is not None }
 
-    row = session.execute(query, (doc_id,)).one()
-    if row:
-        if source.lower() == "openalex":
-            details = {
-                "id": row.id,
-                "title": row.title,
-                "abstract": row.abstract
-            }
+def plan_hydration(statements, docs, cache):
+    details = {}
+    keys_by_source = {}
+    for doc in docs:
+        key = (doc['source'].lower(), doc['id'])
+        if key[0] not in statements or key in details:
+            continue
+        cached = cache.get(key) if cache is not None else None
+        if cached is not None:
+            details[key] = cached
         else:
-            details = {
-                "paperid": row.paperid,
-                "title": row.title,
-                "abstract": row.abstract,
-                "authors": row.authors
-            }
-        return { k: v for k, v in details.items() if v is not None }
-    return {}
+            details[key] = {}
+            keys_by_source.setdefault(key[0], []).append(key[1])
+    pending = [(source, doc_id) for source, doc_ids in keys_by_source.items() for doc_id in doc_ids]
+    return details, pending
+
+def store_hydrated_row(details, key, row, cache):
+    if row:
+        details[key] = row_to_details(key[0], row)
+        if cache is not None:
+            cache.put(key, details[key])
+
+def hydrate_documents(session, statements, docs, deadline=None, cache=None):
+    if deadline is None:
+        deadline = HYDRATION_DEADLINE_SECONDS
+    details, pending = plan_hydration(statements, docs, cache)
+
+    # Every lookup is in flight at once; the driver-side timeout bounds the
+    # whole batch by the request deadline instead of k serial round trips.
+    futures = {key: session.execute_async(statements[key[0]], (key[1],), timeout=deadline) for key in pending}
+    for (source, doc_id), future in futures.items():
+        try:
+            row = future.result().one()
+        except Exception as e:
+            print(f"Lookup for {source}/{doc_id} failed: {e}")
+            continue
+        store_hydrated_row(details, (source, doc_id), row, cache)
+
+    return [details.get((doc['source'].lower(), doc['id']), {}) for doc in docs]
+
+def as_asyncio_future(response_future, loop):
+    future = loop.create_future()
+
+    def resolve(rows):
+        if not future.done():
+            future.set_result(rows)
+
+    def fail(exc):
+        if not future.done():
+            future.set_exception(exc)
+
+    response_future.add_callbacks(
+        callback=lambda rows: loop.call_soon_threadsafe(resolve, rows),
+        errback=lambda exc: loop.call_soon_threadsafe(fail, exc),
+    )
+    return future
 
+async def hydrate_documents_async(session, statements, docs, deadline=None, cache=None):
+    if deadline is None:
+        deadline = HYDRATION_DEADLINE_SECONDS
+    details, pending = plan_hydration(statements, docs, cache)
 
-def retrieve_top_k(query_embedding, index, docs, k=5):
+    loop = asyncio.get_running_loop()
+    futures = {
+        key: as_asyncio_future(session.execute_async(statements[key[0]], (key[1],), timeout=deadline), loop)
+        for key in pending
+    }
+    if futures:
+        _, late = await asyncio.wait(futures.values(), timeout=deadline)
+        for future in late:
+            future.cancel()
+
+    for (source, doc_id), future in futures.items():
+        if future.cancelled():
+            print(f"Lookup for {source}/{doc_id} missed the {deadline}s deadline.")
+            continue
+        if future.exception() is not None:
+            print(f"Lookup for {source}/{doc_id} failed: {future.exception()}")
+            continue
+        rows = future.result()
+        store_hydrated_row(details, (source, doc_id), rows[0] if rows else None, cache)
+
+    return [details.get((doc['source'].lower(), doc['id']), {}) for doc in docs]
+
+def record_document_hits(docs):
+    if not DETAILS_CACHE_WARMUP_SIZE:
+        return
+    with document_hits_lock:
+        document_hits.update((doc['source'].lower(), doc['id']) for doc in docs)
+        if len(document_hits) > 10 * DETAILS_CACHE_WARMUP_SIZE:
+            hottest = document_hits.most_common(DETAILS_CACHE_WARMUP_SIZE)
+            document_hits.clear()
+            document_hits.update(dict(hottest))
+
+def save_hot_documents(path, limit):
+    with document_hits_lock:
+        hottest = [[source, doc_id] for (source, doc_id), _ in document_hits.most_common(limit)]
+    if not hottest:
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(hottest, f)
+    os.replace(tmp_path, path)
+
+def warm_details_cache(session, statements, cache, path, limit, chunk_size=100):
+    if not os.path.exists(path):
+        return 0
+    with open(path) as f:
+        hottest = json.load(f)[:limit]
+    docs = [{'source': source, 'id': doc_id} for source, doc_id in hottest]
+    for start in range(0, len(docs), chunk_size):
+        hydrate_documents(session, statements, docs[start:start + chunk_size],
+                          deadline=10 * HYDRATION_DEADLINE_SECONDS, cache=cache)
+    return len(docs)
+
+
+def normalize_query_text(text):
+    return " ".join(unicodedata.normalize("NFKC", text).lower().split())
+
+def encode_queries(model, normalized_queries):
+    vectors = [query_vector_cache.get(text) for text in normalized_queries]
+    missing = sorted({text for text, vector in zip(normalized_queries, vectors) if vector is None})
+    if missing:
+        with QUERY_STAGE_SECONDS.labels("encode").time():
+            encoded = model.encode(missing, convert_to_numpy=True, batch_size=len(missing)).astype('float32')
+        encoded /= norm(encoded, axis=1, keepdims=True) + 1e-10
+        fresh = dict(zip(missing, encoded))
+        for text, vector in fresh.items():
+            query_vector_cache.put(text, vector)
+        vectors = [fresh[text] if vector is None else vector for text, vector in zip(normalized_queries, vectors)]
+    return np.stack(vectors)
+
+def encode_query(model, normalized_query):
+    return encode_queries(model, [normalized_query])[0]
+
+def set_search_index(state):
+    global search_state
+    # A single reference swap: in-flight queries keep the state they started with.
+    search_state = state
+    # Ranked results are only valid for the index they were computed on.
+    query_result_cache.clear()
+
+def exact_subset_search(index, query_embeddings, k, rows):
+    vectors = index.reconstruct_batch(rows)
+    scores = query_embeddings @ vectors.T
+    top = min(k, len(rows))
+    candidates = np.argpartition(-scores, top - 1, axis=1)[:, :top]
+    order = np.argsort(-np.take_along_axis(scores, candidates, axis=1), axis=1)
+    return rows[np.take_along_axis(candidates, order, axis=1)]
+
+def selector_search_params(index, selection, k, total):
+    selector = selection.selector(total)
+    # Selective filters leave fewer matches per probed list or graph
+    # neighbourhood, so widen the search in proportion.
+    widen = 1.0 / max(selection.fraction, 1e-9)
+    if isinstance(index, faiss.IndexIVF):
+        nprobe = index.nlist if selection.rows is not None else min(index.nlist, int(np.ceil(index.nprobe * widen)))
+        return faiss.SearchParametersIVF(sel=selector, nprobe=nprobe)
+    if isinstance(index, faiss.IndexHNSW):
+        ef_search = min(max(INDEX_CONFIG["ef_search"], k) * 16, int(np.ceil(index.hnsw.efSearch * widen)))
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=max(ef_search, k))
+    return faiss.SearchParameters(sel=selector)
+
+def filtered_search(state, query_embeddings, k, search_filter):
+    selection = state.selection(search_filter)
+    if selection.count == 0:
+        return np.full((len(query_embeddings), 0), -1, dtype=np.int64)
+    index = state.index
+    if selection.rows is not None and not isinstance(index, (faiss.IndexFlat, faiss.IndexIVF)):
+        # Graph search under a tight filter misses most matches; scoring the
+        # few matching rows directly is both exact and cheap.
+        return exact_subset_search(index, query_embeddings, k, selection.rows)
+    params = selector_search_params(index, selection, k, len(state.docs))
+    _, indices = index.search(query_embeddings, k, params=params)
+    return indices
+
+def search_rows(state, query_embeddings, k, search_filter):
+    if search_filter == NO_FILTER:
+        return state.index.search(query_embeddings, k)[1]
+    return filtered_search(state, query_embeddings, k, search_filter)
+
+def search_index(state, query_embeddings, k, search_filter=NO_FILTER):
+    with state.lock.reading(), QUERY_STAGE_SECONDS.labels("search").time():
+        docs = state.docs
+        duplicates = docs.duplicate_count()
+        if not duplicates:
+            indices = search_rows(state, query_embeddings, k, search_filter)
+            return state.version, [[docs.doc_at(i) for i in row if i >= 0] for row in indices]
+
+        # Over-fetch by twice the expected number of duplicates in k hits,
+        # and double it for any query that still comes up short.
+        fetch_k = min(len(docs), k + max(2, int(np.ceil(2 * k * duplicates / len(docs)))))
+        pending = np.arange(len(query_embeddings))
+        collapsed = [None] * len(query_embeddings)
+        while len(pending):
+            indices = search_rows(state, query_embeddings[pending], fetch_k, search_filter)
+            short = []
+            for position, row in zip(pending, indices):
+                collapsed[position] = docs.collapse(row, k)
+                if len(collapsed[position]) < k and len(row) == fetch_k and row[-1] >= 0:
+                    short.append(position)
+            if fetch_k >= len(docs):
+                break
+            pending = np.array(short, dtype=np.int64)
+            fetch_k = min(len(docs), 2 * fetch_k)
+        return state.version, [[docs.doc_at(i) for i in rows] for rows in collapsed]
+
+def search_grouped(state, query_embeddings, requests):
+    """Search each (k, filter) request against one state, one index call per filter."""
+    groups = {}
+    for i, (_, search_filter) in enumerate(requests):
+        groups.setdefault(search_filter, []).append(i)
+    results = [None] * len(requests)
+    version = state.version
+    for search_filter, members in groups.items():
+        k_max = max(requests[i][0] for i in members)
+        version, found = search_index(state, query_embeddings[members], k_max, search_filter)
+        for i, top_docs in zip(members, found):
+            results[i] = top_docs
+    return version, results
+
+def search_query(state, normalized_query, k, search_filter=NO_FILTER):
+    query_embedding = encode_query(embedding_model, normalized_query)
+    return retrieve_top_k(query_embedding, state, k=k, search_filter=search_filter)
+
+def retrieve_top_k(query_embedding, state, k=5, search_filter=NO_FILTER):
     query_embedding = query_embedding / (norm(query_embedding) + 1e-10)
     query_embedding = np.expand_dims(query_embedding.astype('float32'), axis=0)
-    distances, indices = index.search(query_embedding, k)
-    results = []
-    for i in indices[0]:
-        doc = docs[i]
-        results.append({
-            'id': doc['id'],
-            'source': doc['source']
-        })
-    return results
+    version, results = search_index(state, query_embedding, k, search_filter)
+    return version, results[0]
+
+def scan_embedding_changes(session, positions, refreshed_through):
+    try:
+        rows = session.execute("SELECT source, id, WRITETIME(embedding) AS written_at FROM document_embeddings")
+    except Exception as e:
+        print(f"WRITETIME unavailable ({e}); refresh will only pick up new rows.")
+        rows = session.execute("SELECT source, id FROM document_embeddings")
+    new_keys = []
+    changed_keys = []
+    seen = 0
+    for row in rows:
+        key = (row.source, row.id)
+        if key not in positions:
+            new_keys.append(key)
+            continue
+        seen += 1
+        written_at = getattr(row, 'written_at', None)
+        if written_at is not None and refreshed_through is not None and written_at > refreshed_through:
+            changed_keys.append(key)
+    return new_keys, changed_keys, len(positions) - seen
+
+def fetch_embeddings_by_key(session, keys, chunk_size=256):
+    statement = session.prepare("SELECT embedding FROM document_embeddings WHERE source = ? AND id = ?")
+    vectors = {}
+    for start in range(0, len(keys), chunk_size):
+        chunk = keys[start:start + chunk_size]
+        futures = [session.execute_async(statement, key) for key in chunk]
+        for key, future in zip(chunk, futures):
+            row = future.result().one()
+            if row:
+                vector = decode_embedding_blob(row.embedding)
+                vectors[key] = (vector / (norm(vector) + 1e-10)).astype('float32')
+    return vectors
+
+def vector_unchanged(index, row, vector):
+    try:
+        current = index.reconstruct(int(row))
+    except RuntimeError:
+        return False
+    return np.allclose(current, vector, atol=1e-5)
+
+def extend_corpus_version(version, keys, vectors):
+    digest = hashlib.sha1((version or "").encode('utf-8'))
+    for (source, doc_id), vector in zip(keys, vectors):
+        digest.update(source.encode('utf-8'))
+        digest.update(doc_id.encode('utf-8'))
+        digest.update(vector.tobytes())
+    return digest.hexdigest()[:16]
+
+def refresh_index(session):
+    state = search_state
+    started = time.perf_counter()
+    scan_started = int(time.time() * 1e6)
+    positions = state.row_positions()
+    new_keys, changed_keys, removed = scan_embedding_changes(session, positions, state.refreshed_through)
+
+    added = []
+    changed = []
+    if len(new_keys) + len(changed_keys) <= REFRESH_REBUILD_FRACTION * len(positions):
+        vectors = fetch_embeddings_by_key(session, new_keys + changed_keys)
+        added = [key for key in new_keys if key in vectors]
+        changed = [key for key in changed_keys
+                   if key in vectors and not vector_unchanged(state.index, positions[key], vectors[key])]
+    else:
+        changed = changed_keys or new_keys
+
+    if removed or changed:
+        # Rows were rewritten or deleted: build a fresh index next to the
+        # live one and swap it in once it is complete.
+        mode = "rebuild"
+        index, table, version = build_search_index(session)
+        new_state = SearchState(index, table, version, True, scan_started)
+        set_search_index(new_state)
+        added_count = len(new_keys)
+    elif added:
+        added_vectors = np.stack([vectors[key] for key in added])
+        added_years = fetch_years_by_key(session, added)
+        version = extend_corpus_version(state.version, added, added_vectors)
+        if state.mutable:
+            mode = "incremental"
+            with state.lock.writing():
+                state.index.add(added_vectors)
+                for offset, key in enumerate(added):
+                    positions[key] = len(state.docs) + offset
+                state.docs = state.docs.append_rows(added, added_years)
+                state.selections.clear()
+                state.version = version
+                state.refreshed_through = scan_started
+            query_result_cache.clear()
+            new_state = state
+        else:
+            # A memory-mapped snapshot is read-only, and copying the mapped
+            # index does not help: flat/HNSW copies still view the mapped
+            # codes (adding aborts the process) and IVF copies keep on-disk
+            # inverted lists that cannot be opened for writing. Read the
+            # snapshot's index file again without mmap, then add and swap.
+            mode = "copy"
+            index = faiss.read_index(os.path.join(state.snapshot_path, "index.faiss"))
+            apply_search_params(index, INDEX_CONFIG)
+            index.add(added_vectors)
+            new_state = SearchState(index, state.docs.append_rows(added, added_years), version, True, scan_started)
+            set_search_index(new_state)
+        added_count = len(added)
+    else:
+        mode = "none"
+        state.refreshed_through = scan_started
+        new_state = None
+        added_count = 0
+
+    if new_state is not None:
+        with new_state.lock.reading():
+            persist_index_snapshot(new_state.index, new_state.docs, new_state.version, scan_started)
+
+    refresh_state.update({
+        "last_refresh_at": time.time(),
+        "last_refresh_mode": mode,
+        "last_refresh_added": added_count,
+        "last_refresh_seconds": round(time.perf_counter() - started, 3),
+        "last_refresh_error": None,
+    })
+    if mode != "none":
+        print(f"Index refresh ({mode}): {added_count} new documents, version {search_state.version}.")
+
+class IndexRefresher:
+    def __init__(self, session, interval_seconds):
+        self.session = session
+        self.interval_seconds = interval_seconds
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name="index-refresher", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def _run(self):
+        while not self.stopped.wait(self.interval_seconds):
+            try:
+                refresh_index(self.session)
+            except Exception as e:
+                print(f"Index refresh failed: {e}")
+                refresh_state.update({"last_refresh_at": time.time(), "last_refresh_error": str(e)})
+
+class SnapshotFollower:
+    """Re-maps the snapshot when the loader flips CURRENT to a new version."""
+
+    def __init__(self, interval_seconds):
+        self.interval_seconds = interval_seconds
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name="snapshot-follower", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def _run(self):
+        while not self.stopped.wait(self.interval_seconds):
+            try:
+                manifest = read_snapshot_manifest(SNAPSHOT_DIR)
+                if manifest is None or manifest.get("corpus_version") == search_state.version:
+                    continue
+                index, table = load_index_snapshot(manifest)
+                set_search_index(SearchState(index, table, manifest["corpus_version"], False,
+                                             manifest.get("refreshed_through"), manifest["path"]))
+                refresh_state.update({"last_refresh_at": time.time(), "last_refresh_mode": "attach",
+                                      "last_refresh_error": None})
+                print(f"Attached index snapshot {manifest['corpus_version']} with {len(table)} documents.")
+            except Exception as e:
+                print(f"Snapshot follow failed: {e}")
+                refresh_state.update({"last_refresh_at": time.time(), "last_refresh_error": str(e)})
+
+class QueryBatcher:
+    def __init__(self, window_seconds, max_batch_size):
+        self.window_seconds = window_seconds
+        self.max_batch_size = max_batch_size
+        self.pending = queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+        self.batches = 0
+        self.queries = 0
+        self.batch_sizes = Counter()
+        self.queue_wait_total = 0.0
+        self.queue_wait_max = 0.0
+        self.encode_seconds = 0.0
+        self.search_seconds = 0.0
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name="query-batcher", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.pending.put(None)
+
+    def submit(self, normalized_query, k, search_filter=NO_FILTER):
+        future = Future()
+        self.pending.put((normalized_query, k, search_filter, future, time.monotonic()))
+        return future
+
+    def _run(self):
+        while True:
+            item = self.pending.get()
+            if item is None:
+                return
+            batch = [item]
+            stopping = False
+            collect_until = time.monotonic() + self.window_seconds
+            while len(batch) < self.max_batch_size:
+                remaining = collect_until - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self.pending.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._process(batch)
+            if stopping:
+                return
+
+    def _process(self, batch):
+        # A cancelled /query cancels its future through asyncio.wrap_future;
+        # setting a result on it would raise and kill this thread, so drop
+        # those, and mark the rest running so they can no longer be cancelled.
+        batch = [item for item in batch if item[3].set_running_or_notify_cancel()]
+        if not batch:
+            return
+        dequeued_at = time.monotonic()
+        waits = [dequeued_at - enqueued_at for _, _, _, _, enqueued_at in batch]
+        for wait in waits:
+            QUERY_STAGE_SECONDS.labels("batch_wait").observe(wait)
+        try:
+            vectors = encode_queries(embedding_model, [text for text, _, _, _, _ in batch])
+            encoded_at = time.monotonic()
+            version, results = search_grouped(search_state, vectors, [(k, search_filter)
+                                                                     for _, k, search_filter, _, _ in batch])
+            searched_at = time.monotonic()
+        except Exception as e:
+            for _, _, _, future, _ in batch:
+                future.set_exception(e)
+            return
+
+        for (_, k, _, future, _), top_docs in zip(batch, results):
+            future.set_result((version, top_docs[:k]))
+
+        with self.lock:
+            self.batches += 1
+            self.queries += len(batch)
+            self.batch_sizes[len(batch)] += 1
+            self.queue_wait_total += sum(waits)
+            self.queue_wait_max = max(self.queue_wait_max, max(waits))
+            self.encode_seconds += encoded_at - dequeued_at
+            self.search_seconds += searched_at - encoded_at
+
+    def stats(self):
+        with self.lock:
+            return {
+                "window_ms": self.window_seconds * 1000,
+                "max_batch_size": self.max_batch_size,
+                "batches": self.batches,
+                "queries": self.queries,
+                "mean_batch_size": self.queries / self.batches if self.batches else 0.0,
+                "batch_sizes": {str(size): count for size, count in sorted(self.batch_sizes.items())},
+                "mean_queue_wait_ms": 1000 * self.queue_wait_total / self.queries if self.queries else 0.0,
+                "max_queue_wait_ms": 1000 * self.queue_wait_max,
+                "encode_seconds": self.encode_seconds,
+                "search_seconds": self.search_seconds,
+            }
 
 @app.on_event("startup")
 def startup_event():
-    global cassandra_session, docs_metadata, faiss_index, embedding_model
+    global cassandra_session, lookup_statements, embedding_model, query_batcher, index_refresher, cpu_executor
+    global profiler
+    startup_started = time.perf_counter()
     cassandra_session = setup_cassandra_session()
-    docs_metadata = fetch_all_document_embeddings(cassandra_session)
-    print(f"Fetched {len(docs_metadata)} documents from Keyspaces.")
-    faiss_index = build_faiss_index(docs_metadata)
-    embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
-    print("Startup complete: FAISS index and embedding model loaded.")
+    lookup_statements = prepare_lookup_statements(cassandra_session)
+    index_started = time.perf_counter()
+    if INDEX_ATTACH_ONLY:
+        index, table, manifest = attach_index_snapshot()
+        load_path, stale_reason = "attach", None
+    else:
+        index, table, manifest, load_path, stale_reason = load_or_build_index(cassandra_session)
+    set_search_index(SearchState(index, table, manifest.get("corpus_version"), load_path == "rebuild",
+                                 manifest.get("refreshed_through"), manifest.get("path")))
+    index_load_seconds = time.perf_counter() - index_started
+    memory = memory_report(search_state)
+    print(f"Document table: {memory['document_table_bytes'] / 2**20:.1f} MiB for {len(table)} rows; "
+          f"index: {(memory['index_bytes'] or 0) / 2**20:.1f} MiB; "
+          f"resident: {memory['resident_bytes'] / 2**20:.1f} MiB.")
+    with STARTUP_STAGE_SECONDS.labels("model_load").time():
+        embedding_model = load_embedding_model()
+    if PROFILE_THRESHOLD_MS > 0:
+        profiler = SamplingProfiler(PROFILE_INTERVAL_MS / 1000, PROFILE_THRESHOLD_MS / 1000, PROFILE_DIR)
+        profiler.start()
+    cpu_executor = ThreadPoolExecutor(max_workers=CPU_WORKERS, thread_name_prefix="rag-cpu")
+    if BATCH_WINDOW_MS > 0 and BATCH_MAX_SIZE > 1:
+        query_batcher = QueryBatcher(BATCH_WINDOW_MS / 1000, BATCH_MAX_SIZE)
+        query_batcher.start()
+    if INDEX_ATTACH_ONLY:
+        index_refresher = SnapshotFollower(SNAPSHOT_POLL_SECONDS)
+        index_refresher.start()
+    elif REFRESH_INTERVAL_SECONDS > 0:
+        index_refresher = IndexRefresher(cassandra_session, REFRESH_INTERVAL_SECONDS)
+        index_refresher.start()
+    if DETAILS_CACHE_WARMUP_SIZE:
+        try:
+            warmed = warm_details_cache(cassandra_session, lookup_statements, details_cache,
+                                        DETAILS_CACHE_WARMUP_FILE, DETAILS_CACHE_WARMUP_SIZE)
+            print(f"Warmed details cache with {warmed} hot documents.")
+        except Exception as e:
+            print(f"Could not warm details cache: {e}")
+    startup_state.update({
+        "ready": True,
+        "load_path": load_path,
+        "stale_reason": stale_reason,
+        "corpus_version": manifest.get("corpus_version"),
+        "embedding_backend": EMBEDDING_BACKEND,
+        "index_load_seconds": round(index_load_seconds, 3),
+        "startup_seconds": round(time.perf_counter() - startup_started, 3),
+    })
+    print(f"Startup complete via {load_path} in {startup_state['startup_seconds']}s: "
+          f"FAISS index and embedding model loaded.")
+
+@app.on_event("shutdown")
+def shutdown_event():
+    if query_batcher is not None:
+        query_batcher.stop()
+    if index_refresher is not None:
+        index_refresher.stop()
+    if cpu_executor is not None:
+        cpu_executor.shutdown(wait=False)
+    if DETAILS_CACHE_WARMUP_SIZE:
+        try:
+            save_hot_documents(DETAILS_CACHE_WARMUP_FILE, DETAILS_CACHE_WARMUP_SIZE)
+        except Exception as e:
+            print(f"Could not save hot documents: {e}")
+
+@app.middleware("http")
+async def observe_request(request: Request, call_next):
+    if request.url.path == "/metrics":
+        return await call_next(request)
+    started = time.perf_counter()
+    profile_started = profiler.begin() if profiler is not None else None
+    try:
+        return await call_next(request)
+    finally:
+        route = request.scope.get("route")
+        path = route.path if route is not None else "unmatched"
+        REQUEST_SECONDS.labels(path).observe(time.perf_counter() - started)
+        if profile_started is not None:
+            profiler.end(profile_started, path.strip("/").replace("/", "_") or "root")
+
+@app.get("/ready")
+def readiness():
+    status_code = 200 if startup_state["ready"] else 503
+    state = search_state
+    return JSONResponse(status_code=status_code, content={
+        **startup_state,
+        "pid": os.getpid(),
+        "documents": len(state.docs) if state is not None else 0,
+        "index_version": state.version if state is not None else None,
+        "memory": memory_report(state) if state is not None else None,
+        **refresh_state,
+    })
+
+def effective_k(requested_k, total_docs):
+    if requested_k > total_docs:
+        return min(10, total_docs)
+    return requested_k
+
+def search_filter_for(req):
+    if req.year_from is not None and req.year_to is not None and req.year_from > req.year_to:
+        raise HTTPException(status_code=400, detail="year_from must not be after year_to.")
+    return SearchFilter(req.source, req.year_from, req.year_to)
+
+def stream_batch_results(queries, chunk_size):
+    for start in range(0, len(queries), chunk_size):
+        chunk = queries[start:start + chunk_size]
+        state = search_state
+        ks = [effective_k(item.k, len(state.docs)) for item in chunk]
+        filters = [search_filter_for(item) for item in chunk]
+        normalized_queries = [normalize_query_text(item.query) for item in chunk]
+        ranked = [query_result_cache.get((text, k, search_filter, state.version))
+                  for text, k, search_filter in zip(normalized_queries, ks, filters)]
+
+        misses = [i for i, top_docs in enumerate(ranked) if top_docs is None]
+        if misses:
+            vectors = encode_queries(embedding_model, [normalized_queries[i] for i in misses])
+            version, searched = search_grouped(state, vectors, [(ks[i], filters[i]) for i in misses])
+            for i, top_docs in zip(misses, searched):
+                ranked[i] = top_docs[:ks[i]]
+                query_result_cache.put((normalized_queries[i], ks[i], filters[i], version), ranked[i])
+
+        # One hydration pass per chunk so documents shared between queries
+        # are looked up once; the details cache dedupes across chunks.
+        hits = [doc for top_docs in ranked for doc in top_docs]
+        record_document_hits(hits)
+        with QUERY_STAGE_SECONDS.labels("hydrate").time():
+            details = hydrate_documents(cassandra_session, lookup_statements, hits, cache=details_cache)
+        offset = 0
+        for i, (item, top_docs) in enumerate(zip(chunk, ranked)):
+            results = details[offset:offset + len(top_docs)]
+            offset += len(top_docs)
+            yield json.dumps({"index": start + i, "query": item.query, "results": results}) + "\n"
 
 @app.post("/query")
-def query_documents(req: QueryRequest):
-    if embedding_model is None or faiss_index is None or docs_metadata is None:
+async def query_documents(req: QueryRequest):
+    state = search_state
+    if embedding_model is None or state is None:
         raise HTTPException(status_code=500, detail="Service not fully initialized.")
 
-    total_docs = len(docs_metadata)
-    if req.k > total_docs:
-        k = min(10, total_docs)
-    else:
-        k = req.k
-
-    query_embedding = embedding_model.encode(req.query, convert_to_numpy=True)
-    top_docs = retrieve_top_k(query_embedding, faiss_index, docs_metadata, k=k)
+    with admission.slot():
+        k = effective_k(req.k, len(state.docs))
+        search_filter = search_filter_for(req)
+        normalized_query = normalize_query_text(req.query)
+        top_docs = query_result_cache.get((normalized_query, k, search_filter, state.version))
+        if top_docs is None:
+            if query_batcher is not None:
+                version, top_docs = await asyncio.wrap_future(query_batcher.submit(normalized_query, k, search_filter))
+            else:
+                loop = asyncio.get_running_loop()
+                version, top_docs = await loop.run_in_executor(cpu_executor, search_query, state, normalized_query, k,
+                                                               search_filter)
+            query_result_cache.put((normalized_query, k, search_filter, version), top_docs)
 
-    detailed_results = []
-    for doc in top_docs:
-        details = lookup_document_details(cassandra_session, doc['id'], doc['source'])
-        detailed_results.append(details)
+        record_document_hits(top_docs)
+        with QUERY_STAGE_SECONDS.labels("hydrate").time():
+            detailed_results = await hydrate_documents_async(cassandra_session, lookup_statements, top_docs,
+                                                             cache=details_cache)
 
     return {"results": detailed_results}
 
+@app.post("/query/batch")
+def query_documents_batch(req: BatchQueryRequest):
+    if embedding_model is None or search_state is None:
+        raise HTTPException(status_code=500, detail="Service not fully initialized.")
+    # Reject bad filters before the stream starts; errors can't be sent mid-response.
+    for item in req.queries:
+        search_filter_for(item)
+
+    return StreamingResponse(stream_batch_results(req.queries, BATCH_QUERY_CHUNK_SIZE),
+                             media_type="application/x-ndjson")
+
+@app.get("/stats")
+def cache_stats():
+    return {
+        "details_cache": details_cache.stats(),
+        "query_vector_cache": query_vector_cache.stats(),
+        "query_result_cache": query_result_cache.stats(),
+        "query_batcher": query_batcher.stats() if query_batcher is not None else None,
+        "admission": admission.stats(),
+    }
+
+@app.get("/metrics")
+def metrics():
+    return Response(generate_latest(REGISTRY), media_type=CONTENT_TYPE_LATEST)
+
+def serve_workers(workers, host, port, app_path="app:app"):
+    """Build or map the index once, then fork workers that attach to it.
+
+    The snapshot files are mapped read-only, so the index and document
+    table live once in the page cache however many workers share them.
+    Each worker loads its own model and caches; this process keeps the
+    snapshot fresh when refresh is enabled.
+    """
+    session = setup_cassandra_session()
+    index, table, manifest, load_path, _ = load_or_build_index(session)
+    if "path" not in manifest:
+        raise RuntimeError("Index snapshot could not be written; workers have nothing to attach to.")
+    print(f"Loader prepared index {manifest['corpus_version']} via {load_path}; starting {workers} workers.")
+    if REFRESH_INTERVAL_SECONDS > 0:
+        if load_path == "rebuild":
+            # Drop the freshly built copy in favour of the shared mapping.
+            index, table = load_index_snapshot(manifest)
+        set_search_index(SearchState(index, table, manifest["corpus_version"], False,
+                                     manifest.get("refreshed_through"), manifest["path"]))
+        IndexRefresher(session, REFRESH_INTERVAL_SECONDS).start()
+    else:
+        del index, table
+
+    os.environ["INDEX_ATTACH_ONLY"] = "1"
+    # Split the cores between workers so their BLAS/OpenMP pools don't oversubscribe.
+    os.environ.setdefault("OMP_NUM_THREADS", str(max(1, (os.cpu_count() or 1) // workers)))
+    os.environ.setdefault("CPU_WORKERS", os.environ["OMP_NUM_THREADS"])
+    uvicorn.run(app_path, host=host, port=port, workers=workers, app_dir=os.path.dirname(os.path.abspath(__file__)))
+
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8080)
+    if SERVE_WORKERS > 1:
+        serve_workers(SERVE_WORKERS, "0.0.0.0", 8080)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=8080)
@@ -0,0 +1,88 @@
+import json
+import time
+import argparse
+from collections import namedtuple
+import numpy as np
+import faiss
+
+from app import fetch_all_document_embeddings
+from benchmark_index import recall_at_k, sample_queries, synthetic_corpus
+from fake_keyspaces import SyntheticCorpus, encode_embedding_blobs
+
+# Cost of each stored embedding format: bytes the startup scan pulls from
+# Keyspaces, time to decode them into the index matrix, and what the lossy
+# formats do to exact search recall against the float32 vectors.
+
+Row = namedtuple("Row", ("id", "source", "embedding"))
+
+class BlobSession:
+    """Serves pre-encoded rows, so the timing covers decoding and not blob generation."""
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def execute(self, query, parameters=None, timeout=None):
+        return iter(self.rows)
+
+def benchmark_format(blob_format, vectors, queries, exact, k, repeats, bandwidth_mbps):
+    blobs = encode_embedding_blobs(vectors, blob_format, "benchmark")
+    rows = [Row(SyntheticCorpus.doc_id(i), SyntheticCorpus.source(i), blob) for i, blob in enumerate(blobs)]
+    session = BlobSession(rows)
+
+    scan_seconds = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        _, decoded, _ = fetch_all_document_embeddings(session)
+        scan_seconds.append(time.perf_counter() - started)
+
+    faiss.normalize_L2(decoded)
+    index = faiss.IndexFlatIP(decoded.shape[1])
+    index.add(decoded)
+    _, approx = index.search(queries, k)
+    drift = 1.0 - np.sum(decoded * vectors, axis=1)
+    stored_bytes = sum(len(blob) for blob in blobs)
+    return {
+        "format": blob_format,
+        "bytes_per_vector": round(stored_bytes / len(blobs), 1),
+        "bytes_moved": stored_bytes,
+        "scan_seconds": round(min(scan_seconds), 3),
+        # The scan itself runs locally; over Keyspaces the transfer usually dominates.
+        "estimated_startup_seconds": round(min(scan_seconds) + stored_bytes * 8 / (bandwidth_mbps * 1e6), 3),
+        f"recall@{k}": round(recall_at_k(approx, exact, k), 4),
+        "p99_cosine_drift": round(float(np.percentile(drift, 99)), 7),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Size, decode time and recall of the embedding blob formats.")
+    parser.add_argument("--formats", nargs="+", default=["raw", "float32", "float16", "int8"])
+    parser.add_argument("--count", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--bandwidth-mbps", type=float, default=200.0,
+                        help="link speed assumed when estimating startup time from bytes moved")
+    parser.add_argument("--repeats", type=int, default=3, help="startup scans per format; the fastest is reported")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    args = parser.parse_args()
+
+    vectors = synthetic_corpus(args.count, args.dim)
+    queries = sample_queries(vectors, args.queries)
+    reference = faiss.IndexFlatIP(args.dim)
+    reference.add(vectors)
+    _, exact = reference.search(queries, args.k)
+    print(f"{args.count} vectors of dimension {args.dim}, {len(queries)} queries")
+
+    results = []
+    for blob_format in args.formats:
+        result = benchmark_format(blob_format, vectors, queries, exact, args.k, args.repeats, args.bandwidth_mbps)
+        print(json.dumps(result))
+        results.append(result)
+
+    report = {"count": args.count, "dimension": args.dim, "k": args.k, "bandwidth_mbps": args.bandwidth_mbps,
+              "results": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+import sys
+import json
+import time
+import argparse
+import numpy as np
+
+from app import EMBEDDING_MODEL_DIR, EMBEDDING_MODEL_NAME, ONNX_QUANTIZATION, load_sentence_encoder
+
+# Parity and latency check for the query encoder backends. Every candidate
+# is compared with the torch reference on the same texts; the run exits
+# non-zero when a candidate drifts further than --max-drift, so a backend
+# switch can be gated on it.
+
+TOPICS = ("graph neural networks", "protein structure prediction", "climate model downscaling",
+          "sparse attention transformers", "dense passage retrieval", "quantum error correction",
+          "offline reinforcement learning", "causal inference from observational data",
+          "long-read genome assembly", "dark matter halo simulations", "federated optimisation",
+          "mRNA vaccine efficacy", "solid-state battery electrolytes", "speech recognition in noise")
+TEMPLATES = ("{}", "recent advances in {}", "survey of {} methods", "benchmarks for {}",
+             "how does {} scale to large datasets", "{} with limited labelled data")
+
+def sample_texts(path, count, seed=0):
+    if path:
+        with open(path) as f:
+            texts = [line.strip() for line in f if line.strip()]
+        return texts[:count]
+    rng = np.random.default_rng(seed)
+    return [TEMPLATES[rng.integers(len(TEMPLATES))].format(TOPICS[rng.integers(len(TOPICS))])
+            + (f" {rng.integers(1990, 2025)}" if rng.random() < 0.3 else "") for _ in range(count)]
+
+def encode(model, texts, batch_size):
+    vectors = model.encode(texts, convert_to_numpy=True, batch_size=batch_size).astype('float32')
+    return vectors / (np.linalg.norm(vectors, axis=1, keepdims=True) + 1e-10)
+
+def benchmark_backend(backend, texts, threads, model_dir, batch_size):
+    started = time.perf_counter()
+    model = load_sentence_encoder(EMBEDDING_MODEL_NAME, backend, threads, model_dir, ONNX_QUANTIZATION)
+    load_seconds = time.perf_counter() - started
+    encode(model, texts[:8], batch_size)
+
+    latencies = []
+    for text in texts:
+        started = time.perf_counter()
+        encode(model, [text], 1)
+        latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    vectors = encode(model, texts, batch_size)
+    batch_seconds = time.perf_counter() - started
+
+    return vectors, {
+        "backend": backend,
+        "load_seconds": round(load_seconds, 3),
+        "p50_ms": round(1000 * float(np.percentile(latencies, 50)), 3),
+        "p99_ms": round(1000 * float(np.percentile(latencies, 99)), 3),
+        "texts_per_second_batch": round(len(texts) / batch_seconds, 1),
+    }
+
+def drift_report(vectors, reference, k):
+    cosine = np.sum(vectors * reference, axis=1)
+    drift = 1.0 - cosine
+    # Ranking agreement: do the candidate's nearest texts match the reference's?
+    ref_neighbours = np.argsort(-reference @ reference.T, axis=1)[:, 1:k + 1]
+    neighbours = np.argsort(-vectors @ vectors.T, axis=1)[:, 1:k + 1]
+    overlap = np.mean([len(set(a) & set(b)) / k for a, b in zip(neighbours, ref_neighbours)])
+    return {
+        "mean_cosine_drift": round(float(drift.mean()), 6),
+        "p99_cosine_drift": round(float(np.percentile(drift, 99)), 6),
+        "max_cosine_drift": round(float(drift.max()), 6),
+        f"neighbour_overlap@{k}": round(float(overlap), 4),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Parity and latency benchmark for embedding backends.")
+    parser.add_argument("--backends", nargs="+", default=["onnx", "onnx-int8"],
+                        help="candidates to compare against the torch reference")
+    parser.add_argument("--texts", help="file with one query per line; defaults to generated queries")
+    parser.add_argument("--count", type=int, default=500)
+    parser.add_argument("--threads", type=int, default=0, help="encoder threads (0 = library default)")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--model-dir", default=EMBEDDING_MODEL_DIR, help="where exported ONNX models are cached")
+    parser.add_argument("--max-drift", type=float, default=0.01,
+                        help="largest acceptable p99 cosine drift (1 - cos) against the reference")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--output", help="write the JSON report to this file")
+    args = parser.parse_args()
+
+    texts = sample_texts(args.texts, args.count)
+    print(f"Encoding {len(texts)} texts with {EMBEDDING_MODEL_NAME}, threads={args.threads or 'default'}")
+    reference, reference_result = benchmark_backend("torch", texts, args.threads, args.model_dir, args.batch_size)
+    print(json.dumps(reference_result))
+
+    results = [reference_result]
+    for backend in args.backends:
+        vectors, result = benchmark_backend(backend, texts, args.threads, args.model_dir, args.batch_size)
+        result.update(drift_report(vectors, reference, min(args.k, len(texts) - 1)))
+        result["speedup_p50"] = round(reference_result["p50_ms"] / result["p50_ms"], 2)
+        result["passes"] = result["p99_cosine_drift"] <= args.max_drift
+        print(json.dumps(result))
+        results.append(result)
+
+    report = {"model": EMBEDDING_MODEL_NAME, "texts": len(texts), "threads": args.threads,
+              "max_drift": args.max_drift, "results": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if not all(result.get("passes", True) for result in results):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+import os
+import json
+import time
+import argparse
+import numpy as np
+import faiss
+
+from app import INDEX_CONFIG, build_index_from_vectors, read_snapshot_manifest, resident_memory_bytes
+
+def synthetic_corpus(count, dimension, clusters=256, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dimension)).astype('float32')
+    assignments = rng.integers(0, clusters, size=count)
+    vectors = centers[assignments] + 0.7 * rng.standard_normal((count, dimension)).astype('float32')
+    faiss.normalize_L2(vectors)
+    return vectors
+
+def snapshot_corpus(snapshot_dir):
+    manifest = read_snapshot_manifest(snapshot_dir)
+    if manifest is None:
+        raise ValueError(f"No snapshot found in {snapshot_dir}")
+    index = faiss.read_index(os.path.join(manifest['path'], "index.faiss"))
+    if isinstance(index, faiss.IndexIVF):
+        index.make_direct_map()
+    return index.reconstruct_n(0, index.ntotal)
+
+def sample_queries(vectors, count, noise=0.05, seed=1):
+    rng = np.random.default_rng(seed)
+    picks = rng.choice(len(vectors), size=min(count, len(vectors)), replace=False)
+    queries = vectors[picks] + noise * rng.standard_normal((len(picks), vectors.shape[1])).astype('float32')
+    faiss.normalize_L2(queries)
+    return queries
+
+def parse_config(spec):
+    index_type, _, params = spec.partition(":")
+    config = dict(INDEX_CONFIG, type=index_type)
+    for pair in filter(None, params.split(",")):
+        key, _, value = pair.partition("=")
+        if key not in config:
+            raise ValueError(f"Unknown index parameter {key!r} in {spec!r}")
+        config[key] = int(value)
+    return config
+
+def recall_at_k(approx, exact, k):
+    hits = sum(len(set(a[:k]) & set(e[:k])) for a, e in zip(approx, exact))
+    return hits / (len(exact) * k)
+
+def benchmark_config(spec, vectors, queries, exact, k, threads):
+    config = parse_config(spec)
+    rss_before = resident_memory_bytes()
+    started = time.perf_counter()
+    index = build_index_from_vectors(vectors, config)
+    build_seconds = time.perf_counter() - started
+    rss_after = resident_memory_bytes()
+
+    faiss.omp_set_num_threads(threads)
+    started = time.perf_counter()
+    _, approx = index.search(queries, k)
+    batch_seconds = time.perf_counter() - started
+
+    latencies = []
+    for query in queries:
+        started = time.perf_counter()
+        index.search(query[None, :], k)
+        latencies.append(time.perf_counter() - started)
+
+    return {
+        "config": spec,
+        "index_type": type(index).__name__,
+        "build_seconds": round(build_seconds, 3),
+        f"recall@{k}": round(recall_at_k(approx, exact, k), 4),
+        "qps_batch": round(len(queries) / batch_seconds, 1),
+        "qps_single": round(len(queries) / sum(latencies), 1),
+        "p50_ms": round(1000 * float(np.percentile(latencies, 50)), 3),
+        "p99_ms": round(1000 * float(np.percentile(latencies, 99)), 3),
+        "index_bytes": len(faiss.serialize_index(index)),
+        "rss_delta_bytes": rss_after - rss_before,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall/latency benchmark for FAISS index types.")
+    parser.add_argument("--synthetic", type=int, default=100000, help="number of synthetic vectors")
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--snapshot", help="benchmark against the vectors in this snapshot dir instead")
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--threads", type=int, default=os.cpu_count())
+    parser.add_argument("--configs", nargs="+",
+                        default=["flat", "ivf:nprobe=8", "ivf:nprobe=32", "hnsw:ef_search=64", "ivfpq:nprobe=32"],
+                        help="index specs like ivf:nlist=1024,nprobe=16 or hnsw:hnsw_m=32,ef_search=128")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    args = parser.parse_args()
+
+    if args.snapshot:
+        vectors = snapshot_corpus(args.snapshot)
+        corpus = f"snapshot:{args.snapshot}"
+    else:
+        vectors = synthetic_corpus(args.synthetic, args.dim)
+        corpus = f"synthetic:{args.synthetic}x{args.dim}"
+    queries = sample_queries(vectors, args.queries)
+    print(f"Corpus {corpus}: {vectors.shape[0]} vectors, {len(queries)} queries, k={args.k}")
+
+    ground_truth = faiss.IndexFlatIP(vectors.shape[1])
+    ground_truth.add(vectors)
+    _, exact = ground_truth.search(queries, args.k)
+    del ground_truth
+
+    results = []
+    for spec in args.configs:
+        result = benchmark_config(spec, vectors, queries, exact, args.k, args.threads)
+        print(json.dumps(result))
+        results.append(result)
+
+    report = {"corpus": corpus, "vectors": int(vectors.shape[0]), "dimension": int(vectors.shape[1]),
+              "queries": len(queries), "k": args.k, "results": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+import os
+import re
+import sys
+import time
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from cassandra import OperationTimedOut
+
+# Blobs are packed by the embedding job's own writer, so the load test and
+# benchmarks measure the format that ships. These tools run from a checkout,
+# not the service image, so the job's directory is at hand.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "embeddings"))
+from embedding import encode_embedding_blobs
+
+# In-memory stand-in for the Keyspaces session used by app.py. Rows are
+# generated on demand from the row number, so a corpus of millions of
+# vectors costs no memory until the service itself holds it.
+
+TABLE_KEYS = {
+    "document_embeddings": ("source", "id"),
+    "openalex": ("id",),
+    "semantic_scholar": ("paperid",),
+}
+
+SELECT_PATTERN = re.compile(r"^\s*SELECT\s+(?P<columns>.+?)\s+FROM\s+(?:research_data\.)?(?P<table>\w+)"
+                            r"(?:\s+WHERE\s+(?P<where>.+?))?\s*;?\s*$", re.IGNORECASE | re.DOTALL)
+WHERE_PATTERN = re.compile(r"(\w+)\s*=\s*(?:\?|%s)", re.IGNORECASE)
+COLUMN_PATTERN = re.compile(r"^(?:WRITETIME\((?P<writetime>\w+)\)|(?P<column>\w+))(?:\s+AS\s+(?P<alias>\w+))?$",
+                            re.IGNORECASE)
+
+class FakeResultSet(list):
+    def one(self):
+        return self[0] if self else None
+
+class FakeResponseFuture:
+    def __init__(self):
+        self.event = threading.Event()
+        self.lock = threading.Lock()
+        self.rows = None
+        self.error = None
+        self.callbacks = []
+
+    def complete(self, rows=None, error=None):
+        with self.lock:
+            self.rows = rows
+            self.error = error
+            self.event.set()
+            callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            self._fire(*callback)
+
+    def result(self):
+        self.event.wait()
+        if self.error is not None:
+            raise self.error
+        return FakeResultSet(self.rows)
+
+    def add_callbacks(self, callback, errback, callback_args=(), callback_kwargs=None,
+                      errback_args=(), errback_kwargs=None):
+        entry = (callback, callback_args, callback_kwargs or {}, errback, errback_args, errback_kwargs or {})
+        with self.lock:
+            if not self.event.is_set():
+                self.callbacks.append(entry)
+                return
+        self._fire(*entry)
+
+    def _fire(self, callback, callback_args, callback_kwargs, errback, errback_args, errback_kwargs):
+        if self.error is not None:
+            errback(self.error, *errback_args, **errback_kwargs)
+        else:
+            callback(list(self.rows), *callback_args, **callback_kwargs)
+
+class FakePreparedStatement:
+    def __init__(self, query_string):
+        self.query_string = query_string
+
+class SyntheticCorpus:
+    def __init__(self, count, dimension, seed=0, clusters=256, chunk_size=4096, duplicate_every=25,
+                 blob_encoder=None):
+        self.count = count
+        self.dimension = dimension
+        self.seed = seed
+        self.chunk_size = chunk_size
+        # Every duplicate_every-th semantic row re-lists the openalex paper
+        # before it, like papers indexed by both sources.
+        self.duplicate_every = duplicate_every
+        # Packs a block of vectors into stored blobs; bare float32 bytes by default.
+        self.blob_encoder = blob_encoder or (lambda block: [vector.tobytes() for vector in block])
+        self.cached_blobs = (None, None)
+        self.centers = np.random.default_rng(seed).standard_normal((clusters, dimension)).astype(np.float32)
+        self.cached_chunk = (None, None)
+
+    def embeddings(self, chunk):
+        cached_index, cached = self.cached_chunk
+        if cached_index == chunk:
+            return cached
+        start = chunk * self.chunk_size
+        stop = min(start + self.chunk_size, self.count)
+        rng = np.random.default_rng(self.seed + 1 + chunk)
+        assignments = rng.integers(0, len(self.centers), size=stop - start)
+        block = self.centers[assignments] + 0.7 * rng.standard_normal((stop - start, self.dimension)).astype(np.float32)
+        if self.duplicate_every:
+            duplicates = np.flatnonzero([self.duplicate_of(row) is not None for row in range(start, stop)])
+            block[duplicates] = block[duplicates - 1] + 0.02 * rng.standard_normal(
+                (len(duplicates), self.dimension)).astype(np.float32)
+        self.cached_chunk = (chunk, block)
+        return block
+
+    def embedding(self, row):
+        return self.embeddings(row // self.chunk_size)[row % self.chunk_size]
+
+    def blob(self, row):
+        chunk = row // self.chunk_size
+        cached_index, cached = self.cached_blobs
+        if cached_index != chunk:
+            cached = self.blob_encoder(self.embeddings(chunk))
+            self.cached_blobs = (chunk, cached)
+        return cached[row % self.chunk_size]
+
+    def duplicate_of(self, row):
+        if self.duplicate_every and row % 2 == 1 and (row // 2) % self.duplicate_every == 0:
+            return row - 1
+        return None
+
+    @staticmethod
+    def source(row):
+        return "openalex" if row % 2 == 0 else "semantic"
+
+    @staticmethod
+    def doc_id(row):
+        if row % 2 == 0:
+            return f"https://openalex.org/W{row:010d}"
+        return f"{row:040x}"
+
+    def row_number(self, doc_id):
+        try:
+            if doc_id.startswith("https://openalex.org/W"):
+                row = int(doc_id.rsplit("W", 1)[1])
+            else:
+                row = int(doc_id, 16)
+        except ValueError:
+            return None
+        return row if 0 <= row < self.count else None
+
+    def record(self, table, row):
+        doc_id = self.doc_id(row)
+        paper = row if self.duplicate_of(row) is None else self.duplicate_of(row)
+        title = f"Synthetic paper {paper} on topic {paper % 997}"
+        abstract = f"Abstract of synthetic paper {paper}. " * 8
+        if table == "document_embeddings":
+            return {"id": doc_id, "source": self.source(row), "embedding": self.blob(row),
+                    "__writetime__embedding": 1}
+        if table == "openalex":
+            return {"id": doc_id, "title": title, "abstract": abstract, "publication_year": 1990 + paper % 35}
+        return {"paperid": doc_id, "title": title, "abstract": abstract, "year": 1990 + paper % 35,
+                "authors": f"Author {row % 101}, Author {row % 89}"}
+
+    def rows(self, table):
+        if table == "document_embeddings":
+            rows = range(self.count)
+        elif table == "openalex":
+            rows = range(0, self.count, 2)
+        else:
+            rows = range(1, self.count, 2)
+        for row in rows:
+            yield self.record(table, row)
+
+    def lookup(self, table, key):
+        if table == "document_embeddings":
+            source, doc_id = key
+            row = self.row_number(doc_id)
+            if row is None or self.source(row) != source:
+                return None
+        else:
+            row = self.row_number(key[0])
+            if row is None or self.source(row) != ("openalex" if table == "openalex" else "semantic"):
+                return None
+        return self.record(table, row)
+
+class FakeSession:
+    def __init__(self, corpus, latency_ms=0.0, workers=64):
+        self.corpus = corpus
+        self.latency_seconds = latency_ms / 1000
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="fake-keyspaces")
+        self.row_types = {}
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.default_consistency_level = None
+
+    def set_keyspace(self, keyspace):
+        pass
+
+    def prepare(self, query):
+        return FakePreparedStatement(query)
+
+    def execute(self, query, parameters=None, timeout=None):
+        future = self.execute_async(query, parameters, timeout)
+        return future.result()
+
+    def execute_async(self, query, parameters=None, timeout=None):
+        query_string = query.query_string if isinstance(query, FakePreparedStatement) else query
+        with self.lock:
+            self.requests += 1
+        future = FakeResponseFuture()
+        if not self.latency_seconds:
+            self._complete(future, query_string, parameters, timeout)
+        else:
+            self.executor.submit(self._complete, future, query_string, parameters, timeout)
+        return future
+
+    def _complete(self, future, query_string, parameters, timeout):
+        if self.latency_seconds:
+            if timeout is not None and self.latency_seconds > timeout:
+                time.sleep(timeout)
+                future.complete(error=OperationTimedOut(f"fake request exceeded {timeout}s"))
+                return
+            time.sleep(self.latency_seconds)
+        try:
+            future.complete(rows=self._run(query_string, parameters or ()))
+        except Exception as e:
+            future.complete(error=e)
+
+    def _run(self, query_string, parameters):
+        match = SELECT_PATTERN.match(query_string)
+        if match is None:
+            raise ValueError(f"FakeSession cannot run: {query_string}")
+        table = match.group("table").lower()
+        columns = []
+        for expression in match.group("columns").split(","):
+            column = COLUMN_PATTERN.match(expression.strip())
+            if column.group("writetime"):
+                columns.append((column.group("alias") or "writetime", "__writetime__" + column.group("writetime")))
+            else:
+                columns.append((column.group("alias") or column.group("column"), column.group("column")))
+        row_type = self._row_type(table, tuple(name for name, _ in columns))
+
+        where = match.group("where")
+        if not where:
+            # Full scans stream, like a paged driver result.
+            return (row_type(*(record.get(field) for _, field in columns)) for record in self.corpus.rows(table))
+        filters = dict(zip((name.lower() for name in WHERE_PATTERN.findall(where)), parameters))
+        record = self.corpus.lookup(table, tuple(filters[name] for name in TABLE_KEYS[table]))
+        if record is None:
+            return []
+        return [row_type(*(record.get(field) for _, field in columns))]
+
+    def _row_type(self, table, names):
+        key = (table, names)
+        if key not in self.row_types:
+            self.row_types[key] = namedtuple("Row", names)
+        return self.row_types[key]
@@ -0,0 +1,280 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import tempfile
+import threading
+import subprocess
+import http.client
+import numpy as np
+
+# Load test for the /query service. "run" starts the service in a child
+# process against an in-memory Keyspaces stand-in (fake_keyspaces.py), waits
+# for /ready, drives POST /query at a fixed concurrency and reports
+# throughput, latency percentiles, startup time and peak RSS as JSON so runs
+# from different commits can be diffed.
+
+QUERY_WORDS = ("graph neural network protein folding climate model transformer attention sparse retrieval "
+               "quantum error correction reinforcement learning causal inference genome assembly dark matter "
+               "language model federated optimisation vaccine efficacy battery chemistry").split()
+
+class HashingEncoder:
+    """Deterministic stand-in for the sentence encoder when the synthetic
+    corpus dimension differs from the real model's."""
+
+    def __init__(self, dimension):
+        self.dimension = dimension
+
+    def encode(self, texts, convert_to_numpy=True, batch_size=32, **kwargs):
+        vectors = np.empty((len(texts), self.dimension), dtype=np.float32)
+        for i, text in enumerate(texts):
+            seed = int.from_bytes(hashlib.sha1(text.encode('utf-8')).digest()[:8], "little")
+            vectors[i] = np.random.default_rng(seed).standard_normal(self.dimension)
+        return vectors
+
+def patched_service(docs, dim, seed, latency_ms, encoder, blob_format="raw"):
+    import app
+    from fake_keyspaces import FakeSession, SyntheticCorpus, encode_embedding_blobs
+
+    corpus = SyntheticCorpus(docs, dim, seed=seed,
+                             blob_encoder=lambda block: encode_embedding_blobs(block, blob_format, "loadtest"))
+    app.setup_cassandra_session = lambda: FakeSession(corpus, latency_ms=latency_ms)
+    if encoder == "hashing":
+        app.load_embedding_model = lambda: HashingEncoder(dim)
+    return app
+
+def __getattr__(name):
+    # Spawned uvicorn workers import "loadtest:worker_app" and need the same patches.
+    if name == "worker_app":
+        return patched_service(**json.loads(os.environ["LOADTEST_SERVICE"])).app
+    raise AttributeError(name)
+
+def serve(args):
+    import uvicorn
+
+    service = {"docs": args.docs, "dim": args.dim, "seed": args.seed,
+               "latency_ms": args.latency_ms, "encoder": args.encoder, "blob_format": args.blob_format}
+    app = patched_service(**service)
+    if args.workers > 1:
+        os.environ["LOADTEST_SERVICE"] = json.dumps(service)
+        app.serve_workers(args.workers, "127.0.0.1", args.port, app_path="loadtest:worker_app")
+    else:
+        uvicorn.run(app.app, host="127.0.0.1", port=args.port, log_level="warning", access_log=False)
+
+def process_tree(pid):
+    pids = [pid]
+    try:
+        for tid in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{tid}/children") as f:
+                for child in f.read().split():
+                    pids.extend(process_tree(int(child)))
+    except OSError:
+        pass
+    return pids
+
+def proportional_memory_bytes(pid):
+    # PSS splits shared pages (the mapped snapshot) between the processes
+    # mapping them, so the sum over workers is the real footprint.
+    total = 0
+    for member in process_tree(pid):
+        try:
+            with open(f"/proc/{member}/smaps_rollup") as f:
+                for line in f:
+                    if line.startswith("Pss:"):
+                        total += int(line.split()[1]) * 1024
+        except OSError:
+            pass
+    return total or None
+
+def peak_rss_bytes(pid):
+    total = 0
+    for member in process_tree(pid):
+        try:
+            with open(f"/proc/{member}/status") as f:
+                for line in f:
+                    if line.startswith("VmHWM:"):
+                        total += int(line.split()[1]) * 1024
+        except OSError:
+            pass
+    return total or None
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def request_json(connection, method, path, body=None):
+    payload = json.dumps(body).encode('utf-8') if body is not None else None
+    headers = {"Content-Type": "application/json"} if payload is not None else {}
+    connection.request(method, path, body=payload, headers=headers)
+    response = connection.getresponse()
+    data = response.read()
+    return response.status, data
+
+def start_server(args, snapshot_dir):
+    command = [sys.executable, os.path.abspath(__file__), "serve", "--port", str(args.port),
+               "--docs", str(args.docs), "--dim", str(args.dim), "--seed", str(args.seed),
+               "--latency-ms", str(args.latency_ms), "--encoder", args.encoder, "--workers", str(args.workers),
+               "--blob-format", args.blob_format]
+    env = dict(os.environ, SNAPSHOT_DIR=snapshot_dir, PYTHONUNBUFFERED="1")
+    started = time.perf_counter()
+    process = subprocess.Popen(command, env=env, cwd=os.path.dirname(os.path.abspath(__file__)))
+    deadline = started + args.startup_timeout
+    ready_workers = set()
+    while time.perf_counter() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Service exited with code {process.returncode} during startup")
+        try:
+            connection = http.client.HTTPConnection("127.0.0.1", args.port, timeout=5)
+            status, data = request_json(connection, "GET", "/ready")
+            connection.close()
+            if status == 200:
+                ready = json.loads(data)
+                ready_workers.add(ready.get("pid"))
+                if len(ready_workers) >= args.workers:
+                    return process, time.perf_counter() - started, ready
+                continue
+        except OSError:
+            pass
+        time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f"Service not ready after {args.startup_timeout}s")
+
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+def query_pool(size, seed):
+    rng = np.random.default_rng(seed)
+    return [" ".join(rng.choice(QUERY_WORDS, size=rng.integers(2, 6))) for _ in range(size)]
+
+def drive(args, queries):
+    latencies = []
+    statuses = {}
+    errors = 0
+    lock = threading.Lock()
+    next_request = iter(range(args.requests))
+
+    def worker(worker_id):
+        nonlocal errors
+        rng = np.random.default_rng(args.seed + worker_id)
+        connection = http.client.HTTPConnection("127.0.0.1", args.port, timeout=args.request_timeout)
+        local_latencies, local_statuses, local_errors = [], {}, 0
+        while True:
+            with lock:
+                if next(next_request, None) is None:
+                    break
+            body = {"query": queries[rng.integers(len(queries))], "k": args.k}
+            started = time.perf_counter()
+            try:
+                status, _ = request_json(connection, "POST", "/query", body)
+            except (OSError, http.client.HTTPException):
+                local_errors += 1
+                connection.close()
+                connection = http.client.HTTPConnection("127.0.0.1", args.port, timeout=args.request_timeout)
+                continue
+            local_latencies.append(time.perf_counter() - started)
+            local_statuses[status] = local_statuses.get(status, 0) + 1
+        connection.close()
+        with lock:
+            latencies.extend(local_latencies)
+            for status, count in local_statuses.items():
+                statuses[status] = statuses.get(status, 0) + count
+            errors += local_errors
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(args.concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies_ms = 1000 * np.asarray(latencies) if latencies else np.zeros(1)
+    return {
+        "requests": len(latencies) + errors,
+        "elapsed_seconds": round(elapsed, 3),
+        "throughput_rps": round(statuses.get(200, 0) / elapsed, 1),
+        "p50_ms": round(float(np.percentile(latencies_ms, 50)), 2),
+        "p95_ms": round(float(np.percentile(latencies_ms, 95)), 2),
+        "p99_ms": round(float(np.percentile(latencies_ms, 99)), 2),
+        "max_ms": round(float(latencies_ms.max()), 2),
+        "status_counts": {str(status): count for status, count in sorted(statuses.items())},
+        "connection_errors": errors,
+    }
+
+def run(args):
+    snapshot_dir = args.snapshot_dir or tempfile.mkdtemp(prefix="rag-loadtest-")
+    report = {
+        "revision": git_revision(),
+        "params": {key: value for key, value in vars(args).items() if key not in ("command", "output")},
+        "startup": [],
+    }
+    process, startup_seconds, ready = start_server(args, snapshot_dir)
+    report["startup"].append({"load_path": ready.get("load_path"), "ready_seconds": round(startup_seconds, 3),
+                              "service_startup_seconds": ready.get("startup_seconds")})
+    try:
+        queries = query_pool(args.unique_queries, args.seed)
+        if args.warmup:
+            warmup_args = argparse.Namespace(**dict(vars(args), requests=args.warmup))
+            drive(warmup_args, queries)
+        report["load"] = drive(args, queries)
+        report["peak_rss_bytes"] = peak_rss_bytes(process.pid)
+        report["pss_bytes"] = proportional_memory_bytes(process.pid)
+    finally:
+        stop_server(process)
+
+    if args.restart:
+        # A second start measures the snapshot load path written by the first.
+        process, startup_seconds, ready = start_server(args, snapshot_dir)
+        report["startup"].append({"load_path": ready.get("load_path"), "ready_seconds": round(startup_seconds, 3),
+                                  "service_startup_seconds": ready.get("startup_seconds"),
+                                  "peak_rss_bytes": peak_rss_bytes(process.pid)})
+        stop_server(process)
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test for the RAG /query service.")
+    parser.add_argument("command", choices=["run", "serve"], nargs="?", default="run")
+    parser.add_argument("--docs", type=int, default=100000, help="size of the synthetic corpus")
+    parser.add_argument("--dim", type=int, default=384, help="embedding dimension of the synthetic corpus")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--encoder", choices=["model", "hashing"], default="model",
+                        help="'hashing' skips the sentence model; required when --dim differs from the model's")
+    parser.add_argument("--blob-format", choices=["raw", "float32", "float16", "int8"], default="raw",
+                        help="format of the stored embedding blobs")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="simulated Keyspaces latency per request")
+    parser.add_argument("--workers", type=int, default=1, help="serve with this many worker processes")
+    parser.add_argument("--port", type=int, default=8181)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--warmup", type=int, default=100, help="requests sent before measuring")
+    parser.add_argument("--unique-queries", type=int, default=500,
+                        help="size of the query pool; smaller pools exercise the caches harder")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--request-timeout", type=float, default=30.0)
+    parser.add_argument("--startup-timeout", type=float, default=1800.0)
+    parser.add_argument("--snapshot-dir", help="reuse this snapshot dir instead of a fresh temporary one")
+    parser.add_argument("--restart", action="store_true", help="restart once more to time the snapshot load path")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        serve(args)
+    else:
+        run(args)
+
+if __name__ == "__main__":
+    main()